@@ -4,86 +4,504 @@
 """
 seg_cov.py — ARM-compatible, fidele a l'original instance_seg_v2.
 Seul changement : search_radius_vector_3d (open3d, segfault ARM)
-                → query_ball_point (scipy cKDTree, ARM-safe)
+                → sparse_distance_matrix (scipy cKDTree, ARM-safe)
 La logique eigenvalue multi-echelle est identique a l'original.
+open3d n'est importe que par le script (__main__) : get_labels/plot3D
+acceptent tout objet exposant .points (et .colors).
 """
 
+import functools
+import hashlib
 import os
+from collections import OrderedDict
 os.environ["OPENBLAS_NUM_THREADS"] = "1"
 os.environ["OMP_NUM_THREADS"] = "1"
 
 import numpy as np
 from sklearn.cluster import KMeans
 from sklearn.decomposition import PCA
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
 from scipy.spatial import cKDTree
-import open3d
 import time
 
+try:
+    import numba
+except ImportError:   # optionnel : repli sur la version NumPy
+    numba = None
 
-def gets_evs(pts, tree, scale):
+# Composantes uniques d'une covariance 3x3 : xx, yy, zz, xy, xz, yz
+_COV_PAIRS = ((0, 0), (1, 1), (2, 2), (0, 1), (0, 2), (1, 2))
+
+# Cache disque des labels de get_labels (relatif au repertoire courant),
+# limite a CACHE_MAX_ENTRIES fichiers (les moins recemment utilises sont
+# supprimes)
+CACHE_DIR = os.path.join(".cache", "seg_cov")
+CACHE_MAX_ENTRIES = 32
+
+# Rayons (mm) des features eigenvalue multi-echelle
+SCALES = (1.5, 3.0, 6.0)
+
+# Voisinages du dernier nuage traite (LRU), cle = _cloud_key + rayons ;
+# liberes par clear_caches()
+_NEIGHBORS_CACHE_SIZE = 1
+_neighbors_cache = OrderedDict()
+
+
+def _cloud_key(pts):
+    """Empreinte d'un nuage : forme, dtype et BLAKE2b-128 du contenu."""
+    digest = hashlib.blake2b(np.ascontiguousarray(pts).data,
+                             digest_size=16).hexdigest()
+    return pts.shape, pts.dtype.str, digest
+
+
+def _lru_get(cache, size, key, build):
+    """Valeur de `key` dans le cache LRU `cache`, construite par build()."""
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache[key] = value
+        if len(cache) > size:
+            cache.popitem(last=False)
+    else:
+        cache.move_to_end(key)
+    return value
+
+
+def clear_caches():
+    """Libere les voisinages gardes en memoire (le cache disque est conserve)."""
+    _neighbors_cache.clear()
+
+
+def _eig3_sym(C):
     """
-    Calcule les valeurs propres de la covariance locale a chaque point,
-    en utilisant tous les voisins dans un rayon `scale`.
+    Valeurs propres (ordre croissant, comme eigh) d'un lot de matrices
+    symetriques 3x3, donnees par leurs 6 composantes uniques :
+    C de forme (N, 6), colonnes [xx, yy, zz, xy, xz, yz].
 
-    Identique a l'original sauf :
-      open3d search_radius_vector_3d → scipy cKDTree.query_ball_point
+    Forme fermee trigonometrique (Smith 1961) : quelques add/mul/sqrt/cos
+    par matrice, entierement vectorise — pas d'appel LAPACK par point.
+    """
+    a00, a11, a22, a01, a02, a12 = C.T
+
+    p1 = a01**2 + a02**2 + a12**2
+    q  = (a00 + a11 + a22) / 3.0
+    b00, b11, b22 = a00 - q, a11 - q, a22 - q
+    p2 = b00**2 + b11**2 + b22**2 + 2.0 * p1
+    p  = np.sqrt(p2 / 6.0)
+
+    # det(B) / 2 avec B = (C - q*I) / p ; p == 0 → matrice isotrope
+    det = (b00 * (b11 * b22 - a12 * a12)
+           - a01 * (a01 * b22 - a12 * a02)
+           + a02 * (a01 * a12 - b11 * a02))
+    p_safe = np.where(p > 0, p, 1.0)
+    r   = np.clip(det / (2.0 * p_safe**3), -1.0, 1.0)
+    phi = np.arccos(r) / 3.0
+
+    e_max = q + 2.0 * p * np.cos(phi)
+    e_min = q + 2.0 * p * np.cos(phi + 2.0 * np.pi / 3.0)
+    e_mid = 3.0 * q - e_max - e_min
+
+    return np.stack([e_min, e_mid, e_max], axis=1)
+
+
+def radius_neighbors(dists, scale):
+    """
+    Voisinages CSR (indices, indptr) dans un rayon `scale`, extraits de la
+    matrice de distances creuse `dists` (calculee pour un rayon >= scale).
+    Les voisins du point i sont indices[indptr[i]:indptr[i+1]].
     """
-    N = len(pts)
+    keep = dists.data <= scale
+    csum = np.zeros(len(keep) + 1, dtype=np.int64)
+    np.cumsum(keep, out=csum[1:])
+    return dists.indices[keep], csum[dists.indptr]
+
+
+def _gets_evs_numpy(pts, indices, indptr):
+    """Valeurs propres locales, version NumPy vectorisee (reduceat)."""
+    N = len(indptr) - 1
     evs = np.zeros([N, 3])
 
-    # Calculer tous les voisinages en une seule passe (plus efficace)
-    neighbors = tree.query_ball_point(pts, r=scale, workers=1)
+    # Moins de 3 voisins : on laisse [0,0,0]
+    counts = np.diff(indptr)
+    valid  = counts >= 3
+    if not valid.any():
+        return evs
+
+    cnt  = counts[valid]
+    flat = indices[np.repeat(valid, counts)]
+    starts = np.concatenate(([0], np.cumsum(cnt)[:-1]))
+
+    # Covariance (ddof=1, comme np.cov) de chaque voisinage en une passe.
+    # Symetrique : seules les 6 composantes uniques sont accumulees, sur
+    # les coordonnees brutes puis centrees a posteriori :
+    #   C_ab = (sum(x_a * x_b) - n * m_a * m_b) / (n - 1)
+    # → aucune copie centree des voisins. Recentrage global du nuage
+    # (invariant pour la covariance) pour limiter la cancellation.
+    # Produits et sommes accumules en float64 quel que soit le dtype de pts.
+    nb    = pts[flat]
+    nb   -= pts.mean(axis=0, dtype=np.float64).astype(pts.dtype)
+    mean  = np.add.reduceat(nb, starts, axis=0, dtype=np.float64) / cnt[:, None]
+    C = np.empty((len(cnt), 6))
+    for j, (a, b) in enumerate(_COV_PAIRS):
+        prod = np.multiply(nb[:, a], nb[:, b], dtype=np.float64)
+        C[:, j] = (np.add.reduceat(prod, starts)
+                   - cnt * mean[:, a] * mean[:, b])
+    C /= (cnt - 1)[:, None]
+
+    evs[valid] = _eig3_sym(C)
+
+    return evs
+
+
+if numba is not None:
+
+    @numba.njit(cache=True, fastmath=True)
+    def _eig3_sym_nb(xx, yy, zz, xy, xz, yz):
+        """_eig3_sym pour une seule matrice (scalaires), compile Numba."""
+        p1 = xy*xy + xz*xz + yz*yz
+        q  = (xx + yy + zz) / 3.0
+        b00, b11, b22 = xx - q, yy - q, zz - q
+        p  = np.sqrt((b00*b00 + b11*b11 + b22*b22 + 2.0*p1) / 6.0)
+        if p == 0.0:
+            return q, q, q
+
+        det = (b00 * (b11*b22 - yz*yz)
+               - xy * (xy*b22 - yz*xz)
+               + xz * (xy*yz - b11*xz))
+        r = min(max(det / (2.0 * p*p*p), -1.0), 1.0)
+        phi = np.arccos(r) / 3.0
+
+        e_max = q + 2.0 * p * np.cos(phi)
+        e_min = q + 2.0 * p * np.cos(phi + 2.0 * np.pi / 3.0)
+        return e_min, 3.0*q - e_max - e_min, e_max
+
+    @numba.njit(parallel=True, cache=True, fastmath=True)
+    def _gets_evs_numba(pts, indices, indptr):
+        """Valeurs propres locales, un voisinage par iteration prange."""
+        N = len(indptr) - 1
+        evs = np.zeros((N, 3))
+        for i in numba.prange(N):
+            s, e = indptr[i], indptr[i + 1]
+            n = e - s
+            if n < 3:
+                continue
+
+            mx = my = mz = 0.0
+            for k in range(s, e):
+                j = indices[k]
+                mx += pts[j, 0]
+                my += pts[j, 1]
+                mz += pts[j, 2]
+            mx /= n
+            my /= n
+            mz /= n
+
+            xx = yy = zz = xy = xz = yz = 0.0
+            for k in range(s, e):
+                j = indices[k]
+                dx = pts[j, 0] - mx
+                dy = pts[j, 1] - my
+                dz = pts[j, 2] - mz
+                xx += dx*dx
+                yy += dy*dy
+                zz += dz*dz
+                xy += dx*dy
+                xz += dx*dz
+                yz += dy*dz
+
+            f = 1.0 / (n - 1)
+            evs[i, 0], evs[i, 1], evs[i, 2] = _eig3_sym_nb(
+                xx*f, yy*f, zz*f, xy*f, xz*f, yz*f)
+        return evs
+
+
+@functools.lru_cache(maxsize=None)
+def _jax_kernel():
+    """Noyau JAX compile : voisinages completes (N, K) + masque → evs."""
+    import jax
+    import jax.numpy as jnp
+
+    def one_point(nb, mask):
+        w    = mask.astype(nb.dtype)
+        n    = jnp.maximum(w.sum(), 1.0)
+        mean = (nb * w[:, None]).sum(axis=0) / n
+        d    = (nb - mean) * w[:, None]
+        c    = d.T @ d / jnp.maximum(n - 1.0, 1.0)
+        return jnp.linalg.eigvalsh(c)
+
+    batched = jax.vmap(one_point)
+
+    @jax.jit
+    def kernel(pts, idx, mask):
+        return batched(pts[idx], mask)
+
+    return kernel
+
+
+def gets_evs_jax(pts, indices, indptr, chunk=4096):
+    """
+    Variante JAX (optionnelle) de gets_evs : chaque voisinage est complete
+    a K = taille du plus grand voisinage (avec masque) pour que XLA compile
+    une seule fois, puis covariance + eigvalsh vectorises par jax.vmap.
+    Traitement par blocs de `chunk` points pour borner la memoire (chunk, K).
+    """
+    import jax.numpy as jnp
+
+    N      = len(indptr) - 1
+    counts = np.diff(indptr)
+    evs    = np.zeros([N, 3])
+    if N == 0 or counts.max() < 3:
+        return evs
+
+    K      = int(counts.max())
+    kernel = _jax_kernel()
+    pts_j  = jnp.asarray(pts, dtype=jnp.float32)
+
+    for s in range(0, N, chunk):
+        e    = min(s + chunk, N)
+        c    = counts[s:e]
+        seg  = indices[indptr[s]:indptr[e]]
+        rows = np.repeat(np.arange(e - s), c)
+        cols = np.arange(len(seg)) - np.repeat(indptr[s:e] - indptr[s], c)
 
-    for i, idxs in enumerate(neighbors):
-        if len(idxs) >= 3:
-            c = np.cov(pts[idxs].T)
-            evs[i], _ = np.linalg.eigh(c)
-        # sinon on laisse [0,0,0]
+        idx  = np.zeros((chunk, K), dtype=np.int32)
+        mask = np.zeros((chunk, K), dtype=bool)
+        idx[rows, cols]  = seg
+        mask[rows, cols] = True
 
+        evs[s:e] = np.asarray(kernel(pts_j, idx, mask))[:e - s]
+
+    # Moins de 3 voisins : on laisse [0,0,0]
+    evs[counts < 3] = 0.0
     return evs
 
 
-def get_labels(pcd, k=3):
+def gets_evs(pts, indices, indptr, backend="auto"):
+    """
+    Calcule les valeurs propres de la covariance locale a chaque point,
+    en utilisant ses voisins CSR indices[indptr[i]:indptr[i+1]]
+    (voir compute_neighbors).
+
+    `backend` : "auto" (Numba si disponible, sinon NumPy), "numba",
+    "numpy" ou "jax" (gets_evs_jax, jax requis).
+
+    Identique a l'original sauf :
+      open3d search_radius_vector_3d → scipy cKDTree.sparse_distance_matrix
+      np.cov + eigh par point        → covariance en lot + _eig3_sym
+                                       (noyau Numba si disponible)
+    """
+    if backend == "auto":
+        backend = "numba" if numba is not None else "numpy"
+
+    if backend == "jax":
+        return gets_evs_jax(pts, indices, indptr)
+    if backend == "numba":
+        if numba is None:
+            raise ImportError("backend 'numba' demande mais numba absent")
+        return _gets_evs_numba(pts, indices, indptr)
+    if backend == "numpy":
+        return _gets_evs_numpy(pts, indices, indptr)
+    raise ValueError(f"backend inconnu : {backend!r}")
+
+
+def compute_neighbors(pts, radii=SCALES, cache=True):
+    """
+    Voisinages de chaque point pour chaque rayon de `radii` :
+    dict {rayon: (indices, indptr)} au format CSR.
+
+    Une seule requete (plus grand rayon), construite en C sous forme creuse
+    par cKDTree.sparse_distance_matrix, sert tous les rayons. Memoise sur
+    le contenu du nuage et les rayons (dernier nuage seulement, voir
+    clear_caches) : les autres modules peuvent redemander les voisinages
+    d'un nuage deja segmente sans recalcul. L'arbre, qui ne sert qu'ici,
+    n'est pas garde.
+
+    `cache=False` calcule sans memoiser (get_labels : ses labels sont deja
+    en cache disque, garder les voisinages ne ferait que retenir de la RAM).
+    """
+    radii = tuple(radii)
+
+    def build():
+        tree  = cKDTree(pts)
+        dists = tree.sparse_distance_matrix(
+            tree, max_distance=max(radii), output_type='coo_matrix').tocsr()
+        return {r: radius_neighbors(dists, r) for r in radii}
+
+    if not cache:
+        return build()
+    return _lru_get(_neighbors_cache, _NEIGHBORS_CACHE_SIZE,
+                    (_cloud_key(pts), radii), build)
+
+
+def get_labels(pcd, k=3, backend="auto", use_cache=True, standardize=False,
+               voxel_size=None):
     """
     Segmentation par features eigenvalue multi-echelle → PCA → KMeans.
     Identique a l'original (seg_cov.py), ARM-compatible.
 
+    Le resultat est deterministe (random_state=42) : il est mis en cache
+    sur disque dans CACHE_DIR, cle = BLAKE2b du nuage + parametres +
+    backend (JAX calcule en float32). Un nuage deja segmente est relu au
+    lieu d'etre recalcule ; le cache garde au plus CACHE_MAX_ENTRIES
+    fichiers.
+
+    Avec `voxel_size`, les features/PCA/KMeans sont calcules sur le nuage
+    sous-echantillonne (un centroide par voxel) et chaque point recoit le
+    label de son voxel.
+
     Args:
-        pcd : open3d.geometry.PointCloud (coordonnees en mm)
-        k   : nombre de clusters KMeans
+        pcd         : objet avec .points (open3d.geometry.PointCloud ou
+                      equivalent), coordonnees en mm
+        k           : nombre de clusters KMeans
+        backend     : calcul des valeurs propres locales (voir gets_evs)
+        use_cache   : lire/ecrire le cache disque des labels
+        standardize : centrer-reduire les features avant la PCA
+                      (modifie la segmentation, desactive par defaut)
+        voxel_size  : taille de voxel (mm) du sous-echantillonnage
+                      prealable, None = nuage complet
 
     Returns:
-        labels : (N,) int array
+        labels : (N,) int array, ndarray ordinaire (modifiable) que le
+                 resultat vienne du cache ou d'un calcul
     """
-    pts = np.array(pcd.points)
+    if backend == "auto":
+        backend = "numba" if numba is not None else "numpy"
+
+    # float32 C-contigu : divise par 2 le trafic memoire des voisinages ;
+    # nuage recentre avant conversion (covariance invariante par
+    # translation) pour garder ~1e-5 mm de resolution
+    pts = np.asarray(pcd.points, dtype=np.float64)
+    pts = np.ascontiguousarray(pts - pts.mean(axis=0), dtype=np.float32)
     print(f"  get_labels: {len(pts)} points, k_kmeans={k}")
 
-    # cKDTree construit une seule fois, reutilise pour les 3 echelles
-    tree = cKDTree(pts)
+    cache_path = None
+    if use_cache:
+        name = (f"{_cloud_key(pts)[2]}_k{k}_{backend}"
+                f"{'_std' if standardize else ''}"
+                f"{f'_v{voxel_size:g}' if voxel_size else ''}.npy")
+        cache_path = os.path.join(CACHE_DIR, name)
+        labels = _load_labels(cache_path)
+        if labels is not None:
+            print(f"  get_labels: labels en cache ({cache_path})")
+            return labels
+
+    if voxel_size:
+        down, inverse = voxel_downsample(pts, voxel_size)
+        print(f"  get_labels: {len(down)} voxels de {voxel_size:g} mm")
+        labels = classify_from_neighbors(
+            down, compute_neighbors(down, cache=False), k, backend, standardize)[inverse]
+    else:
+        labels = classify_from_neighbors(
+            pts, compute_neighbors(pts, cache=False), k, backend, standardize)
+
+    if cache_path is not None:
+        _save_labels(cache_path, labels)
+    return labels
+
+
+def voxel_downsample(pts, voxel_size):
+    """
+    Sous-echantillonnage sur grille de voxels (equivalent NumPy de
+    open3d voxel_down_sample) : un centroide par voxel occupe.
+
+    Returns:
+        down    : (M, 3) centroides, meme dtype que pts
+        inverse : (N,) indice du voxel (ligne de down) de chaque point
+    """
+    keys  = np.floor(pts / voxel_size).astype(np.int64)
+    keys -= keys.min(axis=0)
+    lin   = np.ravel_multi_index(keys.T, keys.max(axis=0) + 1)
+    _, inverse, counts = np.unique(lin, return_inverse=True,
+                                   return_counts=True)
+
+    down = np.empty((len(counts), 3), dtype=np.float64)
+    for j in range(3):
+        down[:, j] = np.bincount(inverse, weights=pts[:, j],
+                                 minlength=len(counts))
+    down /= counts[:, None]
+    return down.astype(pts.dtype), inverse
 
-    evs0 = gets_evs(pts, tree, 1.5)   # scale 1.5 mm
-    evs1 = gets_evs(pts, tree, 3.0)   # scale 3.0 mm
-    evs2 = gets_evs(pts, tree, 6.0)   # scale 6.0 mm
 
-    s0 = evs0.sum(axis=1)
-    s1 = evs1.sum(axis=1)
-    s2 = evs2.sum(axis=1)
+def _load_labels(path):
+    """
+    Labels du cache (lus entierement : quelques octets par point), None si
+    absents ou illisibles. La lecture rafraichit le mtime, qui sert d'ordre
+    LRU a _prune_labels_cache.
+    """
+    try:
+        labels = np.load(path)
+        os.utime(path)
+        return labels
+    except Exception:
+        return None
 
-    # Eviter division par zero
-    s0[s0 == 0] = 1.0
-    s1[s1 == 0] = 1.0
-    s2[s2 == 0] = 1.0
 
-    fs = np.array([
-        evs0[:, 0]/s0, evs0[:, 1]/s0, evs0[:, 2]/s0,
-        evs1[:, 0]/s1, evs1[:, 1]/s1, evs1[:, 2]/s1,
-        evs2[:, 0]/s2, evs2[:, 1]/s2, evs2[:, 2]/s2,
-    ]).T    # (N, 9)
+def _save_labels(path, labels):
+    """Ecriture atomique (tmp + rename) d'un fichier du cache de labels."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, 'wb') as f:
+            np.save(f, labels)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"  get_labels: cache non ecrit ({e})")
+        return
+    _prune_labels_cache(os.path.dirname(path))
 
-    pca = PCA(n_components=3)
+
+def _prune_labels_cache(cache_dir, max_entries=None):
+    """Supprime les fichiers .npy les moins recemment utilises au-dela de max_entries."""
+    if max_entries is None:
+        max_entries = CACHE_MAX_ENTRIES
+    try:
+        with os.scandir(cache_dir) as it:
+            entries = [(e.stat().st_mtime, e.path) for e in it
+                       if e.name.endswith('.npy')]
+    except OSError:
+        return
+    entries.sort()
+    for _, path in entries[:max(0, len(entries) - max_entries)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def classify_from_neighbors(pts, neighbors, k=3, backend="auto",
+                            standardize=False):
+    """
+    Features eigenvalue multi-echelle → PCA → KMeans sur `pts` (N, 3),
+    a partir des voisinages de compute_neighbors (un par rayon de SCALES).
+
+    Returns:
+        labels : (N,) int array
+    """
+    # Features (N, 9) : valeurs propres normalisees par leur somme, ecrites
+    # directement dans un buffer float32 C-contigu (pas de transposee)
+    fs = np.empty((len(pts), 9), dtype=np.float32)
+    for j, scale in enumerate(SCALES):
+        evs = gets_evs(pts, *neighbors[scale], backend)
+        s = evs.sum(axis=1)
+        s[s == 0] = 1.0    # Eviter division par zero
+        # Une inversion par point puis multiplication (plutot que 3 divisions)
+        inv = np.reciprocal(s, out=s)
+        np.multiply(evs, inv[:, None], out=fs[:, 3*j:3*j + 3])
+
+    # Standardisation optionnelle des 9 colonnes (change la segmentation :
+    # desactivee par defaut pour rester fidele a l'original), puis PCA via
+    # eigh de la covariance 9x9 plutot qu'une SVD (N, 9)
+    pca = Pipeline([
+        ('scaler', StandardScaler() if standardize else 'passthrough'),
+        ('pca', PCA(n_components=3, svd_solver='covariance_eigh')),
+    ])
     res = pca.fit_transform(fs)
 
-    est = KMeans(init='k-means++', n_clusters=k, n_init=100, random_state=42)
+    # 10 initialisations k-means++ suffisent en 3D ; Elkan (inegalite
+    # triangulaire) evite la plupart des calculs de distance
+    est = KMeans(init='k-means++', n_clusters=k, n_init=10,
+                 algorithm='elkan', random_state=42)
     est.fit(res)
 
     return est.labels_
@@ -143,6 +561,9 @@ def plot3D(pcd, centroids=None, normals=None, normal_length=5.0):
 
 
 if __name__ == "__main__":
+    # open3d uniquement pour l'IO du script (import lent, deps GL sur ARM)
+    import open3d
+
     t0  = time.time()
     pcd = open3d.io.read_point_cloud("pointcloud.ply")
     k   = 3
@@ -0,0 +1,8 @@
+"""Configuration pytest : rend importables targeting.* et web_viewer."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests de non-regression de targeting/modules/seg_cov.py : les reecritures
+numeriques (valeurs propres en forme fermee, voisinages CSR, cache de
+labels) doivent rester fideles au pipeline d'origine (query_ball_point +
+np.cov + eigh, PCA, KMeans).
+"""
+
+import os
+
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+from sklearn.cluster import KMeans
+from sklearn.decomposition import PCA
+from sklearn.metrics import adjusted_rand_score
+
+from targeting.modules import seg_cov
+
+
+class _Cloud:
+    """Equivalent minimal d'un open3d.geometry.PointCloud (.points)."""
+
+    def __init__(self, points):
+        self.points = points
+
+
+def _synthetic_cloud(seed=0):
+    """Plan, tige et amas (coordonnees en mm) : geometries bien separees."""
+    rng   = np.random.default_rng(seed)
+    plane = np.c_[rng.uniform(0, 40, (600, 2)), rng.normal(0, 0.1, 600)]
+    stem  = np.c_[rng.normal(60, 0.3, (400, 2)), rng.uniform(0, 40, 400)]
+    blob  = rng.normal([20, 60, 20], 3.0, (500, 3))
+    return np.concatenate([plane, stem, blob])
+
+
+def _reference_evs(pts, tree, scale):
+    """gets_evs d'origine : query_ball_point puis np.cov + eigh par point."""
+    evs = np.zeros([len(pts), 3])
+    for i, idxs in enumerate(tree.query_ball_point(pts, r=scale, workers=1)):
+        if len(idxs) >= 3:
+            evs[i] = np.linalg.eigh(np.cov(pts[idxs].T))[0]
+    return evs
+
+
+def _reference_labels(pts, k=3):
+    """get_labels d'origine (features multi-echelle → PCA → KMeans)."""
+    tree = cKDTree(pts)
+    cols = []
+    for scale in seg_cov.SCALES:
+        evs = _reference_evs(pts, tree, scale)
+        s = evs.sum(axis=1)
+        s[s == 0] = 1.0
+        cols.append(evs / s[:, None])
+    res = PCA(n_components=3).fit_transform(np.hstack(cols))
+    return KMeans(init='k-means++', n_clusters=k, n_init=100,
+                  random_state=42).fit(res).labels_
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    """Cache de labels isole dans un dossier temporaire."""
+    path = tmp_path / "seg_cov"
+    monkeypatch.setattr(seg_cov, "CACHE_DIR", str(path))
+    seg_cov.clear_caches()
+    return path
+
+
+def test_eig3_sym_matches_eigh():
+    rng = np.random.default_rng(1)
+    A   = rng.normal(size=(2000, 3, 3))
+    C   = A @ A.transpose(0, 2, 1)          # symetriques positives
+    C[:10] = np.eye(3) * 2.0                # cas isotrope (p == 0)
+    packed = np.stack([C[:, a, b] for a, b in seg_cov._COV_PAIRS], axis=1)
+
+    expected = np.linalg.eigvalsh(C)
+    np.testing.assert_allclose(seg_cov._eig3_sym(packed), expected,
+                               rtol=0, atol=1e-8 * np.abs(expected).max())
+
+
+def test_radius_neighbors_matches_query_ball_point():
+    pts   = _synthetic_cloud()
+    tree  = cKDTree(pts)
+    neigh = seg_cov.compute_neighbors(pts)
+
+    for scale in seg_cov.SCALES:
+        indices, indptr = neigh[scale]
+        expected = tree.query_ball_point(pts, r=scale, workers=1)
+        np.testing.assert_array_equal(np.diff(indptr),
+                                      [len(e) for e in expected])
+        for i in range(0, len(pts), 97):
+            assert (sorted(indices[indptr[i]:indptr[i + 1]].tolist())
+                    == sorted(expected[i]))
+
+
+@pytest.mark.parametrize("backend", [
+    "numpy",
+    pytest.param("numba", marks=pytest.mark.skipif(
+        seg_cov.numba is None, reason="numba absent")),
+])
+def test_gets_evs_matches_reference(backend):
+    pts  = _synthetic_cloud()
+    tree = cKDTree(pts)
+    neigh = seg_cov.compute_neighbors(pts)
+
+    for scale in seg_cov.SCALES:
+        expected = _reference_evs(pts, tree, scale)
+        got = seg_cov.gets_evs(pts, *neigh[scale], backend)
+        np.testing.assert_allclose(got, expected, rtol=0, atol=1e-6)
+
+
+def test_gets_evs_jax_matches_reference():
+    pytest.importorskip("jax")
+    pts  = _synthetic_cloud()
+    tree = cKDTree(pts)
+    indices, indptr = seg_cov.compute_neighbors(pts)[3.0]
+    expected = _reference_evs(pts, tree, 3.0)
+    got = seg_cov.gets_evs(pts, indices, indptr, backend="jax")
+    np.testing.assert_allclose(got, expected, rtol=0,
+                               atol=1e-5 * np.abs(expected).max())
+
+
+def test_get_labels_agrees_with_original_pipeline(cache_dir):
+    pts = _synthetic_cloud()
+    labels = seg_cov.get_labels(_Cloud(pts), use_cache=False)
+    # float32 + covariance en lot : memes clusters a quelques points pres
+    assert adjusted_rand_score(_reference_labels(pts), labels) > 0.95
+
+
+def test_get_labels_does_not_retain_neighbors(cache_dir):
+    seg_cov.get_labels(_Cloud(_synthetic_cloud()), use_cache=False)
+    seg_cov.get_labels(_Cloud(_synthetic_cloud()), use_cache=False, voxel_size=2.0)
+    assert len(seg_cov._neighbors_cache) == 0
+
+
+def test_label_cache_round_trip(cache_dir):
+    cloud = _Cloud(_synthetic_cloud())
+    first = seg_cov.get_labels(cloud, backend="numpy")
+    files = os.listdir(cache_dir)
+    assert len(files) == 1 and "_numpy" in files[0]
+
+    # Succes de cache : meme resultat, meme type qu'un calcul
+    again = seg_cov.get_labels(cloud, backend="numpy")
+    assert type(again) is np.ndarray and again.flags.writeable
+    np.testing.assert_array_equal(again, first)
+
+    # Backend dans la cle : pas de partage entre numpy et jax/numba
+    assert (seg_cov._load_labels(str(cache_dir / files[0].replace("_numpy", "_jax")))
+            is None)
+
+
+@pytest.mark.parametrize("content", [b"", b"\x93NUMPY tronque"])
+def test_label_cache_corrupt_file_is_a_miss(cache_dir, content):
+    cloud = _Cloud(_synthetic_cloud())
+    expected = seg_cov.get_labels(cloud, backend="numpy", use_cache=False)
+    seg_cov.get_labels(cloud, backend="numpy")
+    (path,) = cache_dir.iterdir()
+    path.write_bytes(content)
+
+    np.testing.assert_array_equal(
+        seg_cov.get_labels(cloud, backend="numpy"), expected)
+    np.testing.assert_array_equal(np.load(path), expected)
+
+
+def test_label_cache_is_pruned(cache_dir, monkeypatch):
+    monkeypatch.setattr(seg_cov, "CACHE_MAX_ENTRIES", 2)
+    cloud = _Cloud(_synthetic_cloud())
+    for k in (2, 3, 4):
+        seg_cov.get_labels(cloud, k=k, backend="numpy")
+    names = sorted(os.listdir(cache_dir))
+    assert len(names) == 2 and not any("_k2_" in n for n in names)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests du cache .npz de session de web_viewer.py (_cache_bg.npz /
+_cache_seg.npz) : aller-retour, invalidation, fichiers corrompus et
+nuage de fond sans session ou sans PLY.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+pytest.importorskip("dash")
+import web_viewer  # noqa: E402
+
+
+@pytest.fixture
+def source(tmp_path):
+    """Fichier source (PLY factice) plus ancien que le cache."""
+    path = tmp_path / "pointcloud.ply"
+    path.write_bytes(b"ply")
+    os.utime(path, (1_000_000, 1_000_000))
+    return path
+
+
+def test_npz_cache_round_trip(tmp_path, source):
+    cache = tmp_path / "_cache_bg.npz"
+    xyz = np.arange(12, dtype=np.float32).reshape(4, 3)
+    web_viewer._save_npz_cache(cache, 3000, xyz=xyz)
+
+    cached = web_viewer._load_npz_cache(cache, [source], 3000)
+    np.testing.assert_array_equal(cached["xyz"], xyz)
+    assert cached["xyz"].dtype == np.float32
+    assert [p.name for p in tmp_path.iterdir() if p.name.endswith(".tmp")] == []
+
+
+def test_npz_cache_invalidation(tmp_path, source):
+    cache = tmp_path / "_cache_bg.npz"
+    web_viewer._save_npz_cache(cache, 3000, xyz=np.zeros((1, 3)))
+
+    # Autre max_points, puis source plus récente que le cache
+    assert web_viewer._load_npz_cache(cache, [source], 500) is None
+    os.utime(source, None)
+    os.utime(cache, (1_000_000, 1_000_000))
+    assert web_viewer._load_npz_cache(cache, [source], 3000) is None
+
+
+@pytest.mark.parametrize("truncate", [True, False])
+def test_npz_cache_corrupt_file_is_a_miss(tmp_path, source, truncate):
+    cache = tmp_path / "_cache_bg.npz"
+    web_viewer._save_npz_cache(cache, 3000, xyz=np.zeros((100, 3)))
+    data = cache.read_bytes()
+    # Tronqué (BadZipFile) ou vide (EOFError), plus récent que la source
+    cache.write_bytes(data[:len(data) // 2] if truncate else b"")
+
+    assert web_viewer._load_npz_cache(cache, [source], 3000) is None
+
+
+def test_npz_cache_missing_source_is_a_silent_miss(tmp_path, capsys):
+    cache = tmp_path / "_cache_bg.npz"
+    web_viewer._save_npz_cache(cache, 3000, xyz=np.zeros((1, 3)))
+
+    assert web_viewer._load_npz_cache(cache, [tmp_path / "absent.ply"], 3000) is None
+    assert "illisible" not in capsys.readouterr().out
+
+
+def test_background_without_session_is_mock():
+    x, y, z = web_viewer.load_pointcloud_with_targeting(None, None, frozenset())
+    assert len(x) == len(y) == len(z) > 0
+    assert x.dtype == np.float32
+
+
+def test_missing_ply_is_not_cached(tmp_path):
+    pytest.importorskip("open3d", exc_type=ImportError)
+    x, _, _ = web_viewer.load_pointcloud_with_targeting(tmp_path, None, frozenset())
+    assert len(x) > 0
+    assert not (tmp_path / "_cache_bg.npz").exists()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tests du rescan des dossiers de session de web_viewer.py : index des
+images de feuilles (leaf_image_paths) et route /leaf-img quand des
+fichiers changent pendant que le viewer tourne.
+"""
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip("dash")
+import web_viewer  # noqa: E402
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    """Session minimale chargée dans app_data (deux feuilles, une image)."""
+    root = tmp_path / "leaf_targeting"
+    session_dir = root / "leaf_analysis_20251211-134611"
+    (session_dir / "analysis").mkdir(parents=True)
+    (session_dir / "images").mkdir()
+    (session_dir / "analysis" / "leaves_data.json").write_text(json.dumps(
+        {"leaves": [{"id": 1, "centroid": [0, 0, 0]},
+                    {"id": 2, "centroid": [1, 0, 0]}]}))
+    (session_dir / "images" / "leaf_2_20251211-1400.jpg").write_bytes(b"old")
+
+    data = web_viewer.load_targeting_data(session_dir)
+    monkeypatch.setattr(web_viewer, "SESSIONS_ROOT", str(root))
+    for key in ("session_dir", "leaves_data", "leaves_table", "visited_leaves",
+                "leaf_image_paths", "fluo_index", "images_dir", "analysis_dir",
+                "scan_mtimes"):
+        monkeypatch.setitem(web_viewer.app_data, key, data[key])
+    return session_dir
+
+
+def _touch_dir(path, offset):
+    """Avance le mtime d'un dossier (résolution grossière de certains FS)."""
+    st = os.stat(path)
+    os.utime(path, (st.st_atime + offset, st.st_mtime + offset))
+
+
+def test_replaced_image_is_reindexed(session):
+    images = session / "images"
+    os.rename(images / "leaf_2_20251211-1400.jpg", images / "leaf_2_20251211-1700.jpg")
+    _touch_dir(images, 5)
+
+    web_viewer._refresh_session_scans()
+    assert web_viewer.app_data['leaf_image_paths'][2].name == "leaf_2_20251211-1700.jpg"
+
+    client = web_viewer.app.server.test_client()
+    r = client.get(f"/leaf-img/{session.name}/2")
+    assert r.status_code == 200 and r.data == b"old"
+
+
+def test_existing_image_keeps_its_path(session):
+    images = session / "images"
+    # Deuxième photo de la feuille 2 et première de la feuille 1
+    (images / "leaf_2_20251211-1000.jpg").write_bytes(b"new")
+    (images / "leaf_1_20251211-1500.jpg").write_bytes(b"leaf1")
+    _touch_dir(images, 5)
+
+    web_viewer._refresh_session_scans()
+    paths = web_viewer.app_data['leaf_image_paths']
+    assert paths[2].name == "leaf_2_20251211-1400.jpg"
+    assert web_viewer.app_data['visited_leaves'] == {1, 2}
+
+    client = web_viewer.app.server.test_client()
+    assert client.get(f"/leaf-img/{session.name}/1").status_code == 200
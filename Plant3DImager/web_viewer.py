@@ -2,18 +2,62 @@
 import dash
 from dash import html, dcc, Input, Output, State, callback_context
 from dash.exceptions import PreventUpdate
+from flask import abort, send_from_directory
 import plotly.graph_objects as go
 import plotly.express as px
+import plotly.io as pio
 import json
+import concurrent.futures
 import numpy as np
 import os
 from pathlib import Path
-import base64
-import time
+from urllib.parse import quote
 import glob
+import re
+import functools
+import itertools
+import threading
+import colorsys
+import socket
+import logging
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+else:
+    # Réponses Dash (figures, tableaux numpy compris) sérialisées par orjson.
+    # "auto" le choisirait déjà ; explicite pour ne pas dépendre du défaut
+    pio.json.config.default_engine = 'orjson'
 
 app = dash.Dash(__name__)
 
+# Répertoire des sessions de targeting (relatif au répertoire de lancement)
+SESSIONS_ROOT = "results/leaf_targeting"
+
+# Plafond de points par trace envoyée au navigateur (payload et rendu WebGL)
+MAX_FIGURE_POINTS = 50000
+
+# Nuage de fond par session, pour ne pas relire le PLY quand seules les
+# feuilles visitées changent ; vidé avec _build_session_figures
+_pointcloud_cache = {}
+
+# Lectures disque (PLY, scandir) : relâchent le GIL, se recouvrent en threads
+_IO_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+
+
+def _load_json(path):
+    """Lit un fichier JSON — orjson si disponible (parsing 3-10x plus rapide)"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if orjson is not None:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass  # ex. NaN écrit par json.dump : orjson le refuse, json l'accepte
+    return json.loads(raw)
+
 # Palette segmentation — même ordre que storage_manager.SEG_PALETTE
 SEG_PALETTE_HEX = [
     '#1f77b4', '#ff7f0e', '#2ca02c', '#d62728',
@@ -27,40 +71,37 @@ SEG_PALETTE_HEX = [
 # Couleurs basées sur Fv/Fm — gradient noir → jaune
 # ─────────────────────────────────────────────────────────────────────────────
 
-def normalize_fvfm(leaves_data, visited_leaves):
+def normalize_fvfm(leaves, visited_leaves):
     """
     Normalisation min-max des valeurs Fv/Fm des feuilles visitées.
+    `leaves` est la table retournée par build_leaves_table.
     Retourne dict {leaf_id: valeur normalisée 0→1}.
     Les feuilles sans fvfm ne sont pas incluses.
     """
-    values = {}
-    for leaf in leaves_data.get('leaves', []):
-        if leaf['id'] in visited_leaves and leaf.get('fvfm') is not None:
-            values[leaf['id']] = leaf['fvfm']
-
-    if not values:
+    mask = np.isin(leaves['ids'], list(visited_leaves)) & ~np.isnan(leaves['fvfm'])
+    if not mask.any():
         return {}
 
-    vmin = min(values.values())
-    vmax = max(values.values())
+    ids    = leaves['ids'][mask].tolist()
+    values = leaves['fvfm'][mask]
 
-    if vmax == vmin:
-        return {lid: 0.5 for lid in values}
+    span = np.ptp(values)
+    if span == 0:
+        return dict.fromkeys(ids, 0.5)
 
-    return {lid: (v - vmin) / (vmax - vmin) for lid, v in values.items()}
+    return dict(zip(ids, ((values - values.min()) / span).tolist()))
 
 
+# Table des 256 teintes du gradient, construite une fois
+_FVFM_LUT = [f'#{i:02x}{i:02x}00' for i in range(256)]
+
 def fvfm_to_color(normalized):
     """Gradient noir (0) → jaune (1) : RGB (0,0,0) → (255,255,0)"""
-    t = max(0.0, min(1.0, normalized))
-    r = int(255 * t)
-    g = int(255 * t)
-    b = 0
-    return f'#{r:02x}{g:02x}{b:02x}'
+    return _FVFM_LUT[int(255 * max(0.0, min(1.0, normalized)))]
 
 def find_latest_targeting_session():
     """Trouve le répertoire de session de targeting le plus récent"""
-    base_pattern = "results/leaf_targeting/leaf_analysis_*"
+    base_pattern = os.path.join(SESSIONS_ROOT, "leaf_analysis_*")
     session_dirs = glob.glob(base_pattern)
     
     if not session_dirs:
@@ -73,19 +114,59 @@ def find_latest_targeting_session():
     print(f"Répertoire de session trouvé: {latest_dir}")
     return Path(latest_dir)
 
+def _session_mtime(session_dir):
+    """mtime de leaves_data.json (0 si absent) — clé d'invalidation du cache"""
+    try:
+        return os.path.getmtime(os.path.join(session_dir, "analysis", "leaves_data.json"))
+    except OSError:
+        return 0.0
+
 def find_all_targeting_sessions():
     """Trouve tous les répertoires de session de targeting - Format generique (label/value)"""
-    base_pattern = "results/leaf_targeting/leaf_analysis_*"
+    base_pattern = os.path.join(SESSIONS_ROOT, "leaf_analysis_*")
     session_dirs = glob.glob(base_pattern)
     
     if not session_dirs:
         return [{'label': 'No sessions found - run targeting first', 'value': None}]
     
-    # Trier par nom (timestamp) décroissant
-    session_dirs.sort(reverse=True)
+    # Clé = (répertoire, mtime) : on ne relit les JSON que si le disque a changé
+    key = tuple((d, _session_mtime(d)) for d in sorted(session_dirs, reverse=True))
+    return list(_build_session_options(key))
+
+def _leaf_count(session_path, leaves_mtime):
+    """
+    Nombre de feuilles d'une session. Mémorisé dans _leaf_count.txt, relu tant
+    qu'il n'est pas plus ancien que leaves_data.json : évite de parser le JSON
+    complet de chaque session pour le libellé du dropdown.
+    """
+    sidecar = session_path / "_leaf_count.txt"
+    try:
+        if os.path.getmtime(sidecar) >= leaves_mtime:
+            return int(sidecar.read_text())
+    except (OSError, ValueError):
+        pass
+    
+    try:
+        leaves_file = session_path / "analysis" / "leaves_data.json"
+        if leaves_file.exists():
+            leaves_data = _load_json(leaves_file)
+            leaf_count = len(leaves_data.get('leaves', []))
+        else:
+            leaf_count = 0
+    except:
+        leaf_count = 0
     
+    try:
+        sidecar.write_text(str(leaf_count))
+    except OSError:
+        pass
+    return leaf_count
+
+@functools.lru_cache(maxsize=1)
+def _build_session_options(key):
+    """Construit les options du dropdown pour une liste (répertoire, mtime) donnée"""
     sessions = []
-    for session_dir in session_dirs:
+    for session_dir, leaves_mtime in key:
         session_path = Path(session_dir)
         
         # Extraire la date du nom du répertoire
@@ -97,7 +178,6 @@ def find_all_targeting_sessions():
             time_str = date_part[9:]  # 134611
             
             # Convertir en format lisible
-            from datetime import datetime
             dt = datetime.strptime(f"{date_str}-{time_str}", "%Y%m%d-%H%M%S")
             formatted_date = dt.strftime("%d/%m/%Y à %H:%M:%S")
             
@@ -105,16 +185,7 @@ def find_all_targeting_sessions():
             formatted_date = session_name
         
         # Compter les feuilles dans la session
-        try:
-            leaves_file = session_path / "analysis" / "leaves_data.json"
-            if leaves_file.exists():
-                with open(leaves_file, 'r') as f:
-                    leaves_data = json.load(f)
-                    leaf_count = len(leaves_data.get('leaves', []))
-            else:
-                leaf_count = 0
-        except:
-            leaf_count = 0
+        leaf_count = _leaf_count(session_path, leaves_mtime)
             
         # Format compatible generique: label lisible + value = chemin
         display_name = f"{session_name} - {formatted_date} ({leaf_count} feuilles)"
@@ -125,6 +196,80 @@ def find_all_targeting_sessions():
     
     return sessions if sessions else [{'label': 'No session files found', 'value': None}]
 
+# Noms de fichiers par feuille, ancrés (re.match) jusqu'à l'extension :
+# photos leaf_{id}_{timestamp}.jpg, mesures fluorescence_leaf_{id}_{timestamp}.json
+_LEAF_RE = re.compile(r'leaf_(\d+)_.+\.jpg$')
+_FLUO_RE = re.compile(r'fluorescence_leaf_(\d+)_.*\.json$')
+
+def _dir_mtime(path):
+    """mtime d'un dossier (0 si absent) — change quand un fichier y est ajouté"""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0.0
+
+def _scan_leaf_images(images_dir):
+    """
+    Index {leaf_id: chemin} de la première image leaf_{id}_{timestamp}.jpg
+    de chaque feuille (même ordre que l'ancien glob). Ses clés sont les
+    feuilles visitées. os.scandir + regex compilée : ni Path ni split par
+    fichier.
+    """
+    index = {}
+    try:
+        with os.scandir(images_dir) as it:
+            for e in it:
+                if m := _LEAF_RE.match(e.name):
+                    index.setdefault(int(m.group(1)), Path(e.path))
+    except OSError:
+        pass  # dossier images/ absent
+    return index
+
+def build_leaves_table(leaves_data):
+    """
+    Table colonne (dict de tableaux numpy) construite une fois par session
+    depuis leaves_data['leaves'] : ids, centroids (N,3), fvfm (NaN si absent),
+    normals (N,3) et has_normal. Les figures lisent ces colonnes au lieu
+    d'itérer sur les dicts feuille par feuille.
+    id_to_idx : table dense id → index de ligne (-1 = inconnu) ; sa dernière
+    case vaut -1, donc np.take(..., mode='clip') envoie tout id trop grand
+    sur -1.
+    """
+    leaves = leaves_data.get('leaves', [])
+    n = len(leaves)
+    table = {
+        'ids':        np.array([leaf['id'] for leaf in leaves], dtype=np.int64),
+        'centroids':  np.array([leaf['centroid'] for leaf in leaves], dtype=float).reshape(n, 3),
+        'fvfm':       np.array([np.nan if leaf.get('fvfm') is None else leaf['fvfm']
+                                for leaf in leaves], dtype=float),
+        'has_normal': np.array(['normal' in leaf for leaf in leaves], dtype=bool),
+        'normals':    np.full((n, 3), np.nan),
+    }
+    if table['has_normal'].any():
+        table['normals'][table['has_normal']] = [leaf['normal'] for leaf in leaves if 'normal' in leaf]
+    table['id_to_idx'] = np.full(int(table['ids'].max(initial=-1)) + 2, -1, dtype=np.int64)
+    table['id_to_idx'][table['ids']] = np.arange(n)
+    return table
+
+def _scan_fluorescence_files(analysis_dir):
+    """
+    Index {leaf_id: chemin} du fichier fluorescence_leaf_{id}_{timestamp}.json
+    le plus récent (nom le plus grand, comme sorted(...)[-1]) de chaque feuille.
+    Construit une fois par session : un clic ne relance pas de glob.
+    """
+    index = {}
+    try:
+        with os.scandir(analysis_dir) as it:
+            for entry in it:
+                m = _FLUO_RE.match(entry.name)
+                if m:
+                    lid = int(m.group(1))
+                    if entry.name > os.path.basename(index.get(lid, '')):
+                        index[lid] = entry.path
+    except OSError:
+        pass  # dossier analysis/ absent
+    return index
+
 def load_targeting_data(session_dir=None):
     """Charge toutes les données d'une session de targeting"""
     if session_dir is None:
@@ -141,52 +286,54 @@ def load_targeting_data(session_dir=None):
         print("Données des feuilles non trouvées")
         return None
     
-    with open(leaves_data_path, 'r') as f:
-        leaves_data = json.load(f)
-    
-    # Trouver les feuilles visitées (avec images)
-    images_dir = session_dir / "images"
-    visited_leaves = []
+    leaves_data = _load_json(leaves_data_path)
     
-    if images_dir.exists():
-        for img_file in images_dir.glob("leaf_*.jpg"):
-            # Extraire l'ID de la feuille du nom du fichier
-            filename = img_file.stem
-            # Format: leaf_{id}_{timestamp}
-            parts = filename.split('_')
-            if len(parts) >= 2:
-                try:
-                    leaf_id = int(parts[1])
-                    visited_leaves.append(leaf_id)
-                except ValueError:
-                    continue
+    # Dossiers scannés, gardés en str (os.scandir/os.stat) pour les rescans
+    images_dir   = str(session_dir / "images")
+    analysis_dir = str(session_dir / "analysis")
     
-    visited_leaves = list(set(visited_leaves))  # Supprimer doublons
-    print(f"Feuilles visitées: {visited_leaves}")
+    # Trouver les feuilles visitées (avec images) ; mtimes relevés avant le
+    # scan pour qu'un fichier écrit pendant celui-ci déclenche un rescan
+    scan_mtimes = (_dir_mtime(images_dir), _dir_mtime(analysis_dir))
+    leaf_image_paths = _scan_leaf_images(images_dir)
+    # frozenset : hashable pour les clés de cache des figures
+    visited_leaves = frozenset(leaf_image_paths)
+    print(f"Feuilles visitées: {sorted(visited_leaves)}")
     
     return {
         "session_dir": session_dir,
         "leaves_data": leaves_data,
-        "visited_leaves": visited_leaves
+        "leaves_table": build_leaves_table(leaves_data),
+        "visited_leaves": visited_leaves,
+        "leaf_image_paths": leaf_image_paths,
+        "fluo_index": _scan_fluorescence_files(analysis_dir),
+        "images_dir": images_dir,
+        "analysis_dir": analysis_dir,
+        "scan_mtimes": scan_mtimes
     }
 
-def load_fluorescence_data_for_leaf(session_dir, leaf_id):
+def load_fluorescence_data_for_leaf(fluo_index, leaf_id):
     """Charge les données de fluorescence pour une feuille spécifique"""
-    analysis_dir = Path(session_dir) / "analysis"
-    
-    # Chercher le fichier de fluorescence pour cette feuille
-    fluo_files = list(analysis_dir.glob(f"fluorescence_leaf_{leaf_id}_*.json"))
+    # Fichier le plus récent de cette feuille (index de _scan_fluorescence_files)
+    fluo_file = fluo_index.get(leaf_id)
     
-    if not fluo_files:
+    if fluo_file is None:
         print(f"Pas de données fluorescence pour feuille {leaf_id}")
-        return [], {}, {}
-    
-    # Prendre le fichier le plus récent
-    fluo_file = sorted(fluo_files)[-1]
+        return [], [], {}
     
+    # Un stat par clic ; le parsing n'est refait que si le fichier a changé
+    try:
+        mtime = os.stat(fluo_file).st_mtime_ns
+    except OSError as e:
+        print(f"Erreur chargement fluorescence feuille {leaf_id}: {e}")
+        return [], [], {}
+    return _parse_fluorescence_file(fluo_file, leaf_id, mtime)
+
+@functools.lru_cache(maxsize=512)
+def _parse_fluorescence_file(fluo_file, leaf_id, mtime):
+    """Parse un fichier fluorescence, mémoïsé sur (chemin, feuille, mtime)"""
     try:
-        with open(fluo_file, 'r') as f:
-            fluo_data = json.load(f)
+        fluo_data = _load_json(fluo_file)
         
         measurements = fluo_data.get('measurements', [])
         
@@ -204,7 +351,51 @@ def load_fluorescence_data_for_leaf(session_dir, leaf_id):
         
     except Exception as e:
         print(f"Erreur chargement fluorescence feuille {leaf_id}: {e}")
-        return [], {}, {}
+        return [], [], {}
+
+def _load_npz_cache(cache_path, sources, max_points):
+    """
+    Relit un cache .npz de session s'il est plus récent que tous ses fichiers
+    sources et a été construit avec le même max_points ; sinon None.
+    (np.load ignore mmap_mode pour un .npz : les tableaux sont lus en mémoire,
+    mais sans passer par le parsing PLY d'Open3D.)
+    Tout échec de lecture (fichier tronqué, vide, clé absente...) vaut un
+    défaut de cache : le nuage est relu depuis le PLY et le cache réécrit.
+    """
+    # Cache ou source absent : simple défaut de cache, rien à signaler
+    try:
+        cache_mtime = os.path.getmtime(cache_path)
+        if any(os.path.getmtime(src) > cache_mtime for src in sources):
+            return None
+    except OSError:
+        return None
+    try:
+        with np.load(cache_path) as data:
+            if int(data["max_points"]) != max_points:
+                return None
+            return {k: data[k] for k in data.files if k != "max_points"}
+    except Exception as e:
+        print(f"Cache illisible ignoré ({cache_path}): {e}")
+        return None
+
+def _save_npz_cache(cache_path, max_points, **arrays):
+    """
+    Écrit un cache .npz de session de façon atomique (tmp + rename) : un
+    arrêt ou deux callbacks concurrents ne laissent jamais de fichier
+    partiel à la place du cache. Un échec d'écriture n'est pas bloquant.
+    """
+    tmp = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        # Objet fichier : np.savez ajouterait « .npz » au nom temporaire
+        with open(tmp, 'wb') as f:
+            np.savez(f, max_points=max_points, **arrays)
+        os.replace(tmp, cache_path)
+    except OSError as e:
+        print(f"Cache non écrit ({cache_path}): {e}")
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
 
 def load_pointcloud_with_targeting(session_dir, leaves_data, visited_leaves,
                                    max_bg_points=3000):
@@ -212,57 +403,76 @@ def load_pointcloud_with_targeting(session_dir, leaves_data, visited_leaves,
     Charge le point cloud brut downsamplé (fond uniquement).
     Les feuilles visitées sont rendues via des traces séparées dans build_visits_figure.
     """
-    pointcloud_path = Path(session_dir) / "pointcloud.ply" if session_dir else None
+    if not session_dir:
+        print("Pas de session — nuage mock")
+        return _mock_pointcloud()
+
+    pointcloud_path = Path(session_dir) / "pointcloud.ply"
+    cache_path = pointcloud_path.with_name("_cache_bg.npz")
+    cached = _load_npz_cache(cache_path, [pointcloud_path], max_bg_points)
+    if cached is not None:
+        pts = cached["xyz"]
+        print(f"Point cloud fond: {len(pts)} pts (cache)")
+        return pts[:, 0], pts[:, 1], pts[:, 2]
 
     try:
         import open3d as o3d
         pcd = o3d.io.read_point_cloud(str(pointcloud_path))
-        pts = np.asarray(pcd.points) * 0.001  # mm → m
 
-        n = len(pts)
+        # PLY absent ou illisible : Open3D renvoie un nuage vide, à ne pas
+        # mettre en cache
+        n = len(pcd.points)
+        if n == 0:
+            raise ValueError(f"nuage vide ({pointcloud_path})")
+
+        # Downsampling côté Open3D, avant la conversion vers numpy
         if n > max_bg_points:
-            idx = np.random.choice(n, max_bg_points, replace=False)
-            pts = pts[idx]
+            pcd = pcd.uniform_down_sample(every_k_points=-(-n // max_bg_points))
+        # float32 : précision largement suffisante à l'affichage, payload divisé par 2
+        pts = (np.asarray(pcd.points) * 0.001).astype(np.float32)  # mm → m
+        _save_npz_cache(cache_path, max_bg_points, xyz=pts)
 
         print(f"Point cloud fond: {len(pts)} pts (après downsampling)")
         return pts[:, 0], pts[:, 1], pts[:, 2]
 
     except Exception as e:
         print(f"Erreur lecture PLY: {e} — fallback mock")
-        n = 2000
-        t = np.linspace(0, 4*np.pi, n)
-        x = np.cos(t) * (1 + 0.3*np.cos(3*t)) + np.random.normal(0, 0.05, n)
-        y = np.sin(t) * (1 + 0.3*np.cos(3*t)) + np.random.normal(0, 0.05, n)
-        z = 0.1 * np.sin(2*t) + np.random.normal(0, 0.02, n)
-        return x, y, z
+        return _mock_pointcloud()
+
+
+def _mock_pointcloud(n=2000):
+    """Nuage de démonstration (pas de session ou PLY illisible)"""
+    t = np.linspace(0, 4*np.pi, n)
+    x = np.cos(t) * (1 + 0.3*np.cos(3*t)) + np.random.normal(0, 0.05, n)
+    y = np.sin(t) * (1 + 0.3*np.cos(3*t)) + np.random.normal(0, 0.05, n)
+    z = 0.1 * np.sin(2*t) + np.random.normal(0, 0.02, n)
+    # float32 comme les nuages réels (PLY et cache)
+    return x.astype(np.float32), y.astype(np.float32), z.astype(np.float32)
 
 
-def build_visits_figure(pc_x, pc_y, pc_z, leaves_data, visited_leaves):
+def build_visits_figure(pc_x, pc_y, pc_z, leaves, visited_leaves):
     """
     Mode 'Feuilles visitées' : fond noir + centroïdes gradient Fv/Fm noir→jaune.
     Les feuilles sans mesure apparaissent en gris.
     """
-    normalized = normalize_fvfm(leaves_data, visited_leaves)
+    normalized = normalize_fvfm(leaves, visited_leaves)
 
     traces = [go.Scatter3d(
         x=pc_x, y=pc_y, z=pc_z,
         mode='markers',
-        marker=dict(size=1, color='black', opacity=0.4),
+        marker=dict(size=1, color='black', opacity=0.4, line=dict(width=0)),
         name='Point cloud',
         hoverinfo='skip',
         showlegend=False,
     )]
 
-    for leaf in leaves_data.get('leaves', []):
-        if leaf['id'] not in visited_leaves:
-            continue
-        c    = leaf['centroid']
-        lid  = leaf['id']
-        fvfm = leaf.get('fvfm')
-
+    visited = np.isin(leaves['ids'], list(visited_leaves))
+    for lid, c, fvfm in zip(leaves['ids'][visited].tolist(),
+                            leaves['centroids'][visited].tolist(),
+                            leaves['fvfm'][visited].tolist()):
         if lid in normalized:
             col   = fvfm_to_color(normalized[lid])
-            label = f'Fv/Fm={fvfm:.3f}' if fvfm is not None else 'Fv/Fm=N/A'
+            label = f'Fv/Fm={fvfm:.3f}'
         else:
             col   = '#808080'
             label = 'Fv/Fm=N/A'
@@ -272,6 +482,7 @@ def build_visits_figure(pc_x, pc_y, pc_z, leaves_data, visited_leaves):
             mode='markers',
             marker=dict(size=12, color=col, symbol='circle',
                         line=dict(color='white', width=1)),
+            customdata=[lid],
             name=f'Feuille {lid}',
             hovertemplate=f'<b>Feuille N°{lid}</b><br>{label}<extra></extra>',
         ))
@@ -284,61 +495,6 @@ def build_visits_figure(pc_x, pc_y, pc_z, leaves_data, visited_leaves):
     )
     return fig
 
-def get_leaf_info_for_display(leaves_data, visited_leaves):
-    """Récupère les infos de la première feuille visitée pour l'affichage"""
-    if not visited_leaves:
-        return {
-            "leaf_id": "Aucune",
-            "centroid": [0, 0, 0],
-            "fvfm": None,
-            "analysis_date": "N/A"
-        }
-    
-    # Prendre la première feuille visitée
-    first_leaf_id = visited_leaves[0]
-    
-    for leaf in leaves_data.get('leaves', []):
-        if leaf['id'] == first_leaf_id:
-            return {
-                "leaf_id": f"LEAF_{leaf['id']:03d}",
-                "centroid": leaf['centroid'],
-                "fvfm": leaf.get('fvfm'),
-                "analysis_date": "2025-12-11"
-            }
-    
-    return {
-        "leaf_id": f"LEAF_{first_leaf_id:03d}",
-        "centroid": [0, 0, 0],
-        "fvfm": None,
-            
-        "analysis_date": "2025-12-11"
-    }
-
-def load_leaf_image_for_display(session_dir, visited_leaves):
-    """Charge l'image de la première feuille visitée"""
-    if not visited_leaves:
-        return None
-    
-    images_dir = Path(session_dir) / "images"
-    first_leaf_id = visited_leaves[0]
-    
-    # Chercher l'image de cette feuille
-    img_files = list(images_dir.glob(f"leaf_{first_leaf_id}_*.jpg"))
-    
-    if not img_files:
-        return None
-    
-    # Prendre la première image trouvée
-    img_path = img_files[0]
-    
-    try:
-        with open(img_path, 'rb') as f:
-            encoded = base64.b64encode(f.read()).decode()
-        return f"data:image/jpeg;base64,{encoded}"
-    except Exception as e:
-        print(f"Erreur chargement image: {e}")
-        return None
-
 def load_segmentation_data(session_dir, max_pts_per_leaf=500):
     """
     Charge segmentation.ply + segmentation_labels.npy.
@@ -351,27 +507,34 @@ def load_segmentation_data(session_dir, max_pts_per_leaf=500):
         print("Fichiers de segmentation absents — mode segmentation indisponible")
         return None
 
+    cache_path = Path(session_dir) / "_cache_seg.npz"
+    cached = _load_npz_cache(cache_path, [seg_ply, seg_labels], max_pts_per_leaf)
+    if cached is not None:
+        xyz, l_out = cached["xyz"], cached["labels"]
+        print(f"Segmentation chargée: {len(l_out)} pts affichés (cache)")
+        return {"x": xyz[:, 0], "y": xyz[:, 1], "z": xyz[:, 2], "labels": l_out}
+
     try:
         import open3d as o3d
         pcd    = o3d.io.read_point_cloud(str(seg_ply))
         pts    = np.asarray(pcd.points)   # déjà en mètres (sauvegardé en m)
         labels = np.load(seg_labels)
 
-        # Downsampling par feuille
-        unique_ids = np.unique(labels)
-        xs, ys, zs, ls = [], [], [], []
-        for lid in unique_ids:
-            mask = labels == lid
-            ix = np.where(mask)[0]
-            if len(ix) > max_pts_per_leaf:
-                ix = np.random.choice(ix, max_pts_per_leaf, replace=False)
-            xs.append(pts[ix, 0]); ys.append(pts[ix, 1])
-            zs.append(pts[ix, 2]); ls.append(np.full(len(ix), lid, dtype=np.uint16))
-
-        x_out = np.concatenate(xs)
-        y_out = np.concatenate(ys)
-        z_out = np.concatenate(zs)
-        l_out = np.concatenate(ls)
+        # Downsampling par feuille, vectorisé : tri par (label, priorité
+        # aléatoire) puis on garde les max_pts_per_leaf premiers de chaque
+        # groupe — équivaut à un tirage sans remise par feuille.
+        order = np.lexsort((np.random.rand(len(labels)), labels))
+        unique_ids, starts, counts = np.unique(labels[order], return_index=True,
+                                               return_counts=True)
+        rank = np.arange(len(order)) - np.repeat(starts, counts)
+        sel  = order[rank < max_pts_per_leaf]
+
+        xyz   = pts[sel].astype(np.float32)
+        x_out = xyz[:, 0]
+        y_out = xyz[:, 1]
+        z_out = xyz[:, 2]
+        l_out = labels[sel].astype(np.uint16)
+        _save_npz_cache(cache_path, max_pts_per_leaf, xyz=xyz, labels=l_out)
 
         print(f"Segmentation chargée: {len(x_out)} pts affichés, "
               f"{len(unique_ids)} feuilles (max {max_pts_per_leaf} pts/feuille)")
@@ -382,34 +545,50 @@ def load_segmentation_data(session_dir, max_pts_per_leaf=500):
         return None
 
 
-def build_segmentation_figure(session_dir, leaves_data, pc_x, pc_y, pc_z):
+def _figure_stride(n, cap=MAX_FIGURE_POINTS):
+    """Pas d'échantillonnage uniforme ramenant n points à au plus cap"""
+    return max(1, -(-n // cap))
+
+
+def _line_segments(starts, ends):
+    """
+    Segments disjoints [start_i, end_i] → coordonnées x, y, z à plat,
+    séparées par None, pour une seule trace Scatter3d mode='lines'.
+    """
+    xyz = np.empty((len(starts) * 3, 3), dtype=object)
+    xyz[0::3] = starts
+    xyz[1::3] = ends
+    xyz[2::3] = None
+    return xyz[:, 0], xyz[:, 1], xyz[:, 2]
+
+
+@functools.lru_cache(maxsize=8)
+def _hsv_colors(n):
+    """Même algo que generate_distinct_colors() dans interactive_selector."""
+    hexcols = []
+    for i in range(n):
+        h = i / n
+        s = 0.7 + 0.3 * (i % 2)
+        v = 0.8 + 0.2 * (i % 3)
+        r, g, b = colorsys.hsv_to_rgb(h, s, v)
+        ri=min(255,max(0,int(r*255))); gi=min(255,max(0,int(g*255))); bi=min(255,max(0,int(b*255))); hexcols.append(f'#{ri:02x}{gi:02x}{bi:02x}')
+    return tuple(hexcols)
+
+
+def build_segmentation_figure(session_dir, leaves, pc_x, pc_y, pc_z):
     """
     Mode Segmentation — reproduit fidèlement interactive_selector.py :
     - Fond du nuage en noir, alpha 0.4, size 1
-    - Une trace par feuille (points colorés, size 3)
+    - Points de toutes les feuilles dans une seule trace (couleur par point)
     - Centroïde plus gros (size 10) avec contour noir
     - Hover "Feuille N°X"
+    Une trace par calque (points, centroïdes, normales) plutôt qu'une par
+    feuille : le coût Plotly croît avec le nombre de traces.
     """
-    import colorsys
-
-    def _hsv_colors(n):
-        """Même algo que generate_distinct_colors() dans interactive_selector."""
-        hexcols = []
-        for i in range(n):
-            h = i / n
-            s = 0.7 + 0.3 * (i % 2)
-            v = 0.8 + 0.2 * (i % 3)
-            r, g, b = colorsys.hsv_to_rgb(h, s, v)
-            ri=min(255,max(0,int(r*255))); gi=min(255,max(0,int(g*255))); bi=min(255,max(0,int(b*255))); hexcols.append(f'#{ri:02x}{gi:02x}{bi:02x}')
-        return hexcols
-
     seg = load_segmentation_data(session_dir)
-    all_leaves = leaves_data.get('leaves', [])
-    n_leaves   = len(all_leaves)
-    colors     = _hsv_colors(n_leaves)
-
-    # Map leaf id → index pour la couleur
-    id_to_idx = {leaf['id']: i for i, leaf in enumerate(all_leaves)}
+    ids        = leaves['ids']
+    n_leaves   = len(ids)
+    colors     = np.array(_hsv_colors(n_leaves))
 
     traces = []
 
@@ -417,103 +596,99 @@ def build_segmentation_figure(session_dir, leaves_data, pc_x, pc_y, pc_z):
     traces.append(go.Scatter3d(
         x=pc_x, y=pc_y, z=pc_z,
         mode='markers',
-        marker=dict(size=1, color='black', opacity=0.4),
+        marker=dict(size=1, color='black', opacity=0.4, line=dict(width=0)),
         name='Point cloud',
         hoverinfo='skip',
         showlegend=False,
     ))
 
-    if seg is not None:
+    if seg is not None and n_leaves:
         x, y, z, labels = seg['x'], seg['y'], seg['z'], seg['labels']
 
-        for i, leaf in enumerate(all_leaves):
-            lid  = leaf['id']
-            col  = colors[id_to_idx.get(lid, 0)]
-            mask = labels == lid
-            if not mask.any():
-                continue
+        # ── Points de toutes les feuilles : une seule trace ────────────
+        # label → index couleur : un seul gather (-1 = feuille inconnue)
+        idx  = np.take(leaves['id_to_idx'], labels, mode='clip')
+        keep = idx >= 0
+        present = np.zeros(n_leaves, dtype=bool)
+        present[idx[keep]] = True
+        # Points triés par feuille : un pas uniforme garde la proportion de
+        # chaque feuille ; present est calculé avant, sur tous les points
+        sel = np.flatnonzero(keep)
+        sel = sel[::_figure_stride(len(sel))]
+        traces.append(go.Scatter3d(
+            x=x[sel], y=y[sel], z=z[sel],
+            mode='markers',
+            marker=dict(size=2, color=colors[idx[sel]], opacity=0.60),
+            customdata=labels[sel],
+            name='Feuilles',
+            hovertemplate='<b>Feuille N°%{customdata}</b><extra></extra>',
+        ))
 
-            # ── Points de la feuille ────────────────────────────────────
-            traces.append(go.Scatter3d(
-                x=x[mask], y=y[mask], z=z[mask],
-                mode='markers',
-                marker=dict(size=2, color=col, opacity=0.60),
-                name=f'Feuille {lid}',
-                legendgroup=f'leaf_{lid}',
-                hovertemplate=f'<b>Feuille N°{lid}</b><extra></extra>',
-                showlegend=True,
-            ))
+        cents = leaves['centroids'][present]
+
+        # ── Centroïdes + numéros : une seule trace ──────────────────────
+        traces.append(go.Scatter3d(
+            x=cents[:, 0], y=cents[:, 1], z=cents[:, 2],
+            mode='markers+text',
+            marker=dict(size=8, color=colors[present],
+                        line=dict(color='black', width=2)),
+            text=ids[present].astype(str),
+            textposition='top center',
+            textfont=dict(size=11, color='black'),
+            customdata=ids[present],
+            name='Centroïdes',
+            hovertemplate='<b>Feuille N°%{text}</b><br>'
+                          '(%{x:.3f}, %{y:.3f}, %{z:.3f})<extra></extra>',
+        ))
 
-            # ── Centroïde + numéro ──────────────────────────────────────
-            c = leaf['centroid']
+        # ── Normales (flèche : ligne + losange à la pointe) ─────────────
+        with_normal = present & leaves['has_normal']
+        if with_normal.any():
+            nl   = 0.05          # longueur du fût 5 cm
+            base = leaves['centroids'][with_normal]
+            tips = base + leaves['normals'][with_normal] * nl
+
+            # Fûts des flèches : une trace 'lines', segments séparés par None
+            sx, sy, sz = _line_segments(base, tips)
             traces.append(go.Scatter3d(
-                x=[c[0]], y=[c[1]], z=[c[2]],
-                mode='markers+text',
-                marker=dict(size=8, color=col, line=dict(color='black', width=2)),
-                text=[str(lid)],
-                textposition='top center',
-                textfont=dict(size=11, color='black'),
-                name=f'Feuille {lid}',
-                legendgroup=f'leaf_{lid}',
+                x=sx, y=sy, z=sz,
+                mode='lines',
+                line=dict(color='red', width=4),
+                name='Normales',
                 showlegend=False,
-                hovertemplate=f'<b>Feuille N°{lid}</b><br>'
-                              f'({c[0]:.3f}, {c[1]:.3f}, {c[2]:.3f})<extra></extra>',
+                hoverinfo='skip',
             ))
 
-            # ── Normale (vraie flèche : ligne + cône à la pointe) ──────
-            if 'normal' in leaf:
-                n   = leaf['normal']
-                nl  = 0.05          # longueur du fût 5 cm
-                tip = [c[0] + n[0]*nl, c[1] + n[1]*nl, c[2] + n[2]*nl]
-
-                # Fût de la flèche
-                traces.append(go.Scatter3d(
-                    x=[c[0], tip[0]], y=[c[1], tip[1]], z=[c[2], tip[2]],
-                    mode='lines',
-                    line=dict(color='red', width=4),
-                    showlegend=False,
-                    hoverinfo='skip',
-                ))
-
-                # Tête de la flèche
-                head = 0.012  # taille du cône
-                traces.append(go.Cone(
-                    x=[tip[0]], y=[tip[1]], z=[tip[2]],
-                    u=[n[0]*head], v=[n[1]*head], w=[n[2]*head],
-                    colorscale=[[0, 'red'], [1, 'red']],
-                    showscale=False,
-                    sizemode='absolute',
-                    sizeref=head,
-                    anchor='tail',
-                    showlegend=False,
-                    hoverinfo='skip',
-                ))
-
-    else:
-        # Pas de segmentation : centroïdes uniquement
-        for i, leaf in enumerate(all_leaves):
-            lid = leaf['id']
-            col = colors[id_to_idx.get(lid, 0)]
-            c   = leaf['centroid']
+            # Têtes des flèches : un marqueur losange par pointe, une seule trace
             traces.append(go.Scatter3d(
-                x=[c[0]], y=[c[1]], z=[c[2]],
-                mode='markers+text',
-                marker=dict(size=12, color=col, symbol='diamond',
-                            line=dict(color='black', width=2)),
-                text=[str(lid)],
-                textposition='top center',
-                textfont=dict(size=12, color='black'),
-                name=f'Feuille {lid}',
-                hovertemplate=f'<b>Feuille N°{lid}</b><extra></extra>',
+                x=tips[:, 0], y=tips[:, 1], z=tips[:, 2],
+                mode='markers',
+                marker=dict(symbol='diamond', size=6, color='red', line=dict(width=0)),
+                showlegend=False,
+                hoverinfo='skip',
             ))
 
+    elif n_leaves:
+        # Pas de segmentation : centroïdes uniquement, une seule trace
+        cents = leaves['centroids']
+        traces.append(go.Scatter3d(
+            x=cents[:, 0], y=cents[:, 1], z=cents[:, 2],
+            mode='markers+text',
+            marker=dict(size=12, color=colors, symbol='diamond',
+                        line=dict(color='black', width=2)),
+            text=ids.astype(str),
+            textposition='top center',
+            textfont=dict(size=12, color='black'),
+            name='Centroïdes',
+            hovertemplate='<b>Feuille N°%{text}</b><extra></extra>',
+        ))
+
     fig = go.Figure(data=traces)
     fig.update_layout(
         scene=dict(aspectmode='data'),
         margin=dict(l=0, r=0, b=0, t=30),
         title=f"Segmentation — {n_leaves} feuilles détectées",
-        legend=dict(itemsizing='constant', font=dict(size=10),
-                    title=dict(text='Feuilles')),
+        legend=dict(itemsizing='constant', font=dict(size=10)),
     )
     return fig
 
@@ -523,6 +698,7 @@ targeting_data = load_targeting_data()
 if targeting_data:
     session_dir = targeting_data["session_dir"]
     leaves_data = targeting_data["leaves_data"] 
+    leaves_table = targeting_data["leaves_table"]
     visited_leaves = targeting_data["visited_leaves"]
     
     # Ne pas pré-charger les données de feuille - attendre sélection utilisateur
@@ -557,9 +733,54 @@ else:
         "analysis_date": "2025-12-11"
     }
     leaf_image_src = None
-    visited_leaves = []
+    visited_leaves = frozenset()
     session_dir = None
     leaves_data = {"leaves": []}
+    leaves_table = build_leaves_table(leaves_data)
+
+initial_sessions = find_all_targeting_sessions()
+
+# États vides des panneaux feuille — construits une fois, partagés par le
+# layout initial et les callbacks
+_EMPTY_LEAF_INFO = [
+    html.Div("⌀ Aucune feuille sélectionnée", 
+            style={'textAlign': 'center', 'color': '#666', 'fontSize': '12px', 
+                   'padding': '20px', 'fontStyle': 'italic'})
+]
+_EMPTY_IMAGE = html.Div(
+    "⌀ Aucune image chargée",
+    style={
+        'height': '160px', 'backgroundColor': '#f5f5f5', 'display': 'flex',
+        'alignItems': 'center', 'justifyContent': 'center',
+        'borderRadius': '5px', 'fontSize': '12px', 'color': '#666',
+        'border': '2px dashed #ccc', 'fontStyle': 'italic'
+    }
+)
+
+# Graphique fluorescence en dict brut (Dash l'accepte tel quel) : pas de
+# passage par les validateurs go.* à chaque clic. Le template par défaut,
+# qu'un go.Figure ajoute de lui-même, est sérialisé une fois ici.
+_FLUOR_LAYOUT = {
+    'template': pio.templates[pio.templates.default].to_plotly_json(),
+    'xaxis': {'title': {'text': "Temps (s)"}},
+    'yaxis': {'title': {'text': "Intensité"}},
+    'margin': {'l': 50, 'r': 50, 'b': 50, 't': 50},
+    'plot_bgcolor': 'white',
+    'height': 280
+}
+_EMPTY_CHART = {
+    'data': [],
+    'layout': _FLUOR_LAYOUT | {
+        'title': {'text': "⌀ Aucune données de fluorescence chargées"},
+        'showlegend': False,
+        'annotations': [{
+            'text': 'Cliquez sur une feuille dans le point cloud<br>pour afficher ses données de fluorescence',
+            'xref': 'paper', 'yref': 'paper',
+            'x': 0.5, 'y': 0.5, 'xanchor': 'center', 'yanchor': 'middle',
+            'showarrow': False, 'font': {'size': 14, 'color': '#666'}
+        }]
+    }
+}
 
 # Layout responsive
 app.layout = html.Div([
@@ -582,8 +803,8 @@ app.layout = html.Div([
             html.Div([
                 dcc.Dropdown(
                     id='session-selector',
-                    options=find_all_targeting_sessions(),
-                    value=find_all_targeting_sessions()[0]['value'] if find_all_targeting_sessions() and find_all_targeting_sessions()[0]['value'] else None,
+                    options=initial_sessions,
+                    value=initial_sessions[0]['value'],
                     placeholder="Sélectionner une session...",
                     style={'fontSize': '12px', 'flex': '1'}
                 ),
@@ -617,6 +838,11 @@ app.layout = html.Div([
     
     # Signal invisible pour déclencher la mise à jour des callbacks
     html.Div(id='session-changed-signal', style={'display': 'none'}, children='0'),
+    # Figures 3D des deux vues, centroïdes des feuilles visitées (pour la
+    # sélection côté client) et feuille cliquée
+    dcc.Store(id='leaves-store'),
+    dcc.Store(id='figs-store'),
+    dcc.Store(id='selected-leaf'),
 
     html.Div([
         # Zone principale - Point Cloud (plus étroite)
@@ -639,7 +865,7 @@ app.layout = html.Div([
             }),
             dcc.Graph(
                 id='pointcloud-3d',
-                figure=build_visits_figure(pc_x, pc_y, pc_z, leaves_data, visited_leaves),
+                figure=build_visits_figure(pc_x, pc_y, pc_z, leaves_table, visited_leaves),
                 style={'height': '500px', 'width': '100%'}
             )
         ], style={
@@ -656,11 +882,7 @@ app.layout = html.Div([
             # Info panel - maintenant dynamique
             html.Div([
                 html.H4("Informations Feuille", style={'marginBottom': '10px', 'fontSize': '14px'}),
-                html.Div([
-                    html.Div("⌀ Aucune feuille sélectionnée", 
-                            style={'textAlign': 'center', 'color': '#666', 'fontSize': '12px', 
-                                   'padding': '20px', 'fontStyle': 'italic'})
-                ], id='leaf-info-content')
+                html.Div(_EMPTY_LEAF_INFO, id='leaf-info-content')
             ], style={
                 'backgroundColor': '#f8f9fa', 
                 'padding': '15px', 
@@ -674,17 +896,7 @@ app.layout = html.Div([
             # Image panel avec ratio 16:9 - maintenant dynamique
             html.Div([
                 html.H4("Image Feuille", style={'marginBottom': '10px', 'fontSize': '14px'}),
-                html.Div([
-                    html.Div(
-                        "⌀ Aucune image chargée",
-                        style={
-                            'height': '160px', 'backgroundColor': '#f5f5f5', 'display': 'flex',
-                            'alignItems': 'center', 'justifyContent': 'center',
-                            'borderRadius': '5px', 'fontSize': '12px', 'color': '#666',
-                            'border': '2px dashed #ccc', 'fontStyle': 'italic'
-                        }
-                    )
-                ], id='leaf-image-content')
+                html.Div(_EMPTY_IMAGE, id='leaf-image-content')
             ], style={
                 'flex': '1',
                 'border': '1px solid #000',  # Bordure noire fine
@@ -712,21 +924,7 @@ app.layout = html.Div([
     html.Div([
         dcc.Graph(
             id='fluorescence-chart',
-            figure=go.Figure().update_layout(
-                title="⌀ Aucune données de fluorescence chargées",
-                xaxis_title="Temps (s)",
-                yaxis_title="Intensité", 
-                margin=dict(l=50, r=50, b=50, t=50),
-                showlegend=False,
-                plot_bgcolor='white',
-                height=280,
-                annotations=[{
-                    'text': 'Cliquez sur une feuille dans le point cloud<br>pour afficher ses données de fluorescence',
-                    'xref': 'paper', 'yref': 'paper',
-                    'x': 0.5, 'y': 0.5, 'xanchor': 'center', 'yanchor': 'middle',
-                    'showarrow': False, 'font': {'size': 14, 'color': '#666'}
-                }]
-            )
+            figure=_EMPTY_CHART
         )
     ], style={
         'border': '1px solid #000',  # Bordure noire fine
@@ -788,42 +986,42 @@ app_data = {
     'targeting_data': targeting_data,
     'session_dir': session_dir,
     'leaves_data': leaves_data,
+    'leaves_table': leaves_table,
     'visited_leaves': visited_leaves,
+    'leaf_image_paths': targeting_data['leaf_image_paths'] if targeting_data else {},
+    'fluo_index': targeting_data['fluo_index'] if targeting_data else {},
+    'images_dir': targeting_data['images_dir'] if targeting_data else None,
+    'analysis_dir': targeting_data['analysis_dir'] if targeting_data else None,
+    'scan_mtimes': targeting_data['scan_mtimes'] if targeting_data else (None, None),
+    'panels_scan_mtimes': None,  # scan_mtimes au dernier rendu des panneaux feuille
     'current_leaf_id': current_leaf_id if targeting_data else None  # None au lieu de 1
 }
 
-def find_clicked_leaf(click_data, visited_leaves, leaves_data):
-    """Trouve la feuille la plus proche du point cliqué"""
-    if not click_data or not click_data.get('points'):
-        return None
-    
-    # Coordonnées du clic
-    clicked_point = click_data['points'][0]
-    click_x = clicked_point['x']
-    click_y = clicked_point['y'] 
-    click_z = clicked_point['z']
-    
-    # Trouver la feuille la plus proche
-    min_distance = float('inf')
-    closest_leaf_id = None
-    
-    for leaf in leaves_data.get('leaves', []):
-        if leaf['id'] in visited_leaves:
-            centroid = leaf['centroid']
-            
-            # Distance euclidienne
-            distance = ((click_x - centroid[0])**2 + 
-                       (click_y - centroid[1])**2 + 
-                       (click_z - centroid[2])**2)**0.5
-            
-            if distance < min_distance:
-                min_distance = distance
-                closest_leaf_id = leaf['id']
-    
-    # Seuil de proximité (2cm)
-    if min_distance < 0.02:
-        return closest_leaf_id
-    return None
+def _refresh_session_scans():
+    """
+    Relit images/ et analysis/ de la session courante seulement si leur
+    mtime a changé depuis le dernier scan (fait par load_targeting_data au
+    chargement de la session). Deux stat() : appelé à chaque clic et à chaque
+    image servie, pour voir les fichiers écrits pendant que le viewer tourne.
+    """
+    if not app_data['session_dir']:
+        return
+    images_dir, analysis_dir = app_data['images_dir'], app_data['analysis_dir']
+    mtimes = (_dir_mtime(images_dir), _dir_mtime(analysis_dir))
+    old = app_data['scan_mtimes']
+    if mtimes[0] != old[0]:
+        # Les feuilles déjà indexées gardent leur image (et donc leur URL)
+        # tant que le fichier existe ; une image remplacée ou renommée prend
+        # le nouveau chemin, les feuilles disparues sont retirées
+        paths = _scan_leaf_images(images_dir)
+        old_paths = app_data['leaf_image_paths']
+        paths.update((lid, old_paths[lid]) for lid in old_paths.keys() & paths.keys()
+                     if os.path.exists(old_paths[lid]))
+        app_data['leaf_image_paths'] = paths
+        app_data['visited_leaves'] = frozenset(paths)
+    if mtimes[1] != old[1]:
+        app_data['fluo_index'] = _scan_fluorescence_files(analysis_dir)
+    app_data['scan_mtimes'] = mtimes
 
 def get_leaf_info_by_id(leaf_id, leaves_data):
     """Récupère les infos d'une feuille par son ID"""
@@ -843,26 +1041,54 @@ def get_leaf_info_by_id(leaf_id, leaves_data):
         "analysis_date": "2025-12-11"
     }
 
+def _is_current_session(session_dir):
+    """session_dir désigne-t-il la session chargée dans app_data ?"""
+    return bool(app_data['session_dir']) and Path(session_dir) == Path(app_data['session_dir'])
+
 def get_leaf_image_by_id(leaf_id, session_dir):
-    """Charge l'image d'une feuille par son ID"""
+    """Chemin de l'image d'une feuille par son ID (None si absente)"""
     if not session_dir:
         return None
-    
-    images_dir = Path(session_dir) / "images"
-    img_files = list(images_dir.glob(f"leaf_{leaf_id}_*.jpg"))
-    
-    if not img_files:
-        return None
-    
-    img_path = img_files[0]
-    
-    try:
-        with open(img_path, 'rb') as f:
-            encoded = base64.b64encode(f.read()).decode()
-        return f"data:image/jpeg;base64,{encoded}"
-    except Exception as e:
-        print(f"Erreur chargement image feuille {leaf_id}: {e}")
-        return None
+    if _is_current_session(session_dir):
+        return app_data['leaf_image_paths'].get(leaf_id)
+    # Autre session (URL /leaf-img d'un onglet resté ouvert) : scan ponctuel
+    return _scan_leaf_images(Path(session_dir) / "images").get(leaf_id)
+
+def leaf_image_url(leaf_id, session_dir, img_path):
+    """
+    URL servie par la route /leaf-img (le navigateur télécharge et met en cache).
+    Le nom du fichier (horodaté) sert de version : une nouvelle photo change
+    l'URL, ce qui rend sûr le max_age de la route.
+    """
+    return (f"/leaf-img/{quote(Path(session_dir).name)}/{leaf_id}"
+            f"?v={quote(Path(img_path).name)}")
+
+# Route Flask : sert l'image JPEG directement plutôt qu'en base64 dans le callback
+@app.server.route('/leaf-img/<session>/<int:lid>')
+def serve_leaf_image(session, lid):
+    if not session.startswith("leaf_analysis_") or Path(session).name != session:
+        abort(404)
+    session_dir = Path(SESSIONS_ROOT) / session
+    if _is_current_session(session_dir):
+        _refresh_session_scans()
+    img_path = get_leaf_image_by_id(lid, session_dir)
+    if img_path is None:
+        abort(404)
+    # conditional : ETag / If-Modified-Since → 304 sans renvoyer l'image
+    return send_from_directory(img_path.parent.resolve(), img_path.name,
+                               mimetype='image/jpeg', conditional=True, max_age=3600)
+
+def build_leaves_store(leaves, visited_leaves):
+    """
+    Contenu du store 'leaves-store' : ids et centroïdes (à plat, x0 y0 z0 x1 ...)
+    des feuilles visitées, seules cliquables, et index id → rang (clés str,
+    comme en JSON) pour résoudre un clic portant l'id de sa feuille.
+    """
+    visited = np.isin(leaves['ids'], list(visited_leaves))
+    ids = leaves['ids'][visited].tolist()
+    return {'ids': ids,
+            'centroids': leaves['centroids'][visited].ravel().tolist(),
+            'index': {str(lid): i for i, lid in enumerate(ids)}}
 
 # Callback pour actualiser la liste des sessions
 @app.callback(
@@ -881,10 +1107,13 @@ def refresh_sessions(n_clicks, current_value):
     return sessions, new_value
 
 
+# Valeurs successives du signal de changement de session (le layout part de '0') :
+# deux changements rapprochés donnent toujours deux valeurs distinctes
+_signal_counter = itertools.count(1)
+
 # Callback pour charger une session sélectionnée (dropdown direct)
 @app.callback(
-    [Output('current-session-info', 'children'),
-     Output('session-changed-signal', 'children')],
+    Output('session-changed-signal', 'children'),
     [Input('session-selector', 'value')]
 )
 def load_selected_session(selected_session_path):
@@ -901,83 +1130,174 @@ def load_selected_session(selected_session_path):
     app_data['targeting_data'] = new_targeting_data
     app_data['session_dir'] = new_targeting_data['session_dir']
     app_data['leaves_data'] = new_targeting_data['leaves_data']
+    app_data['leaves_table'] = new_targeting_data['leaves_table']
     app_data['visited_leaves'] = new_targeting_data['visited_leaves']
+    app_data['leaf_image_paths'] = new_targeting_data['leaf_image_paths']
+    app_data['fluo_index'] = new_targeting_data['fluo_index']
+    app_data['images_dir'] = new_targeting_data['images_dir']
+    app_data['analysis_dir'] = new_targeting_data['analysis_dir']
+    app_data['scan_mtimes'] = new_targeting_data['scan_mtimes']
     app_data['current_leaf_id'] = None
+    _parse_fluorescence_file.cache_clear()
+    _build_session_figures.cache_clear()
+    _pointcloud_cache.clear()
 
-    session_name = Path(selected_session_path).name
-    session_info_text = f"Session actuelle : {session_name}"
+    signal_value = str(next(_signal_counter))
 
-    import time as _time
-    signal_value = str(int(_time.time()))
+    return signal_value
 
-    return session_info_text, signal_value
+
+# Libellé de session côté client, sur le signal (donc une fois la session
+# réellement chargée côté serveur)
+app.clientside_callback(
+    """
+    function(signal, path) {
+        if (!path) {
+            return dash_clientside.no_update;
+        }
+        return 'Session actuelle : ' + path.split(/[\\\\/]/).pop();
+    }
+    """,
+    Output('current-session-info', 'children'),
+    Input('session-changed-signal', 'children'),
+    State('session-selector', 'value')
+)
 
 
-# Callback pointcloud — se déclenche sur changement de session ou de mode
+# Callback pointcloud — construit les deux vues d'une session en une fois ;
+# le changement de mode est ensuite résolu côté client depuis figs-store
 @app.callback(
-    Output('pointcloud-3d', 'figure'),
+    [Output('figs-store', 'data'),
+     Output('leaves-store', 'data')],
     [Input('session-changed-signal', 'children'),
-     Input('view-mode', 'value')]
+     Input('refresh-sessions-btn', 'n_clicks')]
 )
-def update_pointcloud_figure(session_signal, view_mode):
+def update_pointcloud_figures(session_signal, n_clicks):
     """
-    Reconstruit la figure 3D uniquement quand la session ou le mode change.
-    En mode visits, relit le dossier images/ pour être à jour.
+    Reconstruit les figures 3D (segmentation et visites) quand la session
+    change ou sur « Actualiser ». Relit le dossier images/ pour être à jour.
     """
     session_dir  = app_data.get('session_dir')
-    leaves_data  = app_data.get('leaves_data', {"leaves": []})
 
-    # Rafraîchir visited_leaves depuis le disque à chaque changement de mode/session
+    # Rafraîchir visited_leaves (et l'index fluorescence) si le disque a changé,
+    # pendant que le nuage de fond (indépendant des feuilles visitées) est lu
+    # dans un autre thread
     if session_dir:
-        images_dir = Path(session_dir) / "images"
-        visited = []
-        if images_dir.exists():
-            for img_file in images_dir.glob("leaf_*.jpg"):
-                parts = img_file.stem.split('_')
-                if len(parts) >= 2:
-                    try:
-                        visited.append(int(parts[1]))
-                    except ValueError:
-                        pass
-        app_data['visited_leaves'] = list(set(visited))
-
-    visited_leaves = app_data.get('visited_leaves', [])
-
-    pc_x, pc_y, pc_z = load_pointcloud_with_targeting(
-        session_dir, leaves_data, visited_leaves
-    )
+        key = str(session_dir)
+        fut_pc = None
+        if key not in _pointcloud_cache:
+            fut_pc = _IO_POOL.submit(load_pointcloud_with_targeting,
+                                     key, app_data['leaves_data'], frozenset())
+        _refresh_session_scans()
+        if fut_pc is not None:
+            _pointcloud_cache[key] = fut_pc.result()
 
-    if view_mode == 'segmentation' and session_dir:
-        return build_segmentation_figure(session_dir, leaves_data, pc_x, pc_y, pc_z)
+    return _build_session_figures(str(session_dir) if session_dir else None,
+                                  app_data['visited_leaves'])
 
-    return build_visits_figure(pc_x, pc_y, pc_z, leaves_data, visited_leaves)
 
+@functools.lru_cache(maxsize=8)
+def _build_session_figures(session_dir, visited_key):
+    """
+    Figures (segmentation, visites) + leaves-store pour une session et un
+    ensemble de feuilles visitées donnés. Lit la table de feuilles de la
+    session courante : le cache est vidé à chaque chargement de session.
+    """
+    leaves_data = app_data.get('leaves_data', {"leaves": []})
+    leaves      = app_data['leaves_table']
 
-# Callback pour mise à jour des infos feuille
-@app.callback(
-    Output('leaf-info-content', 'children'),
-    [Input('pointcloud-3d', 'clickData'),
-     Input('session-changed-signal', 'children')],
-    prevent_initial_call=True
+    if session_dir not in _pointcloud_cache:
+        _pointcloud_cache[session_dir] = load_pointcloud_with_targeting(
+            session_dir, leaves_data, visited_key
+        )
+    pc_x, pc_y, pc_z = _pointcloud_cache[session_dir]
+    # Vues (sans copie) plafonnées à MAX_FIGURE_POINTS ; tous les chemins de
+    # load_pointcloud_with_targeting renvoient déjà du float32
+    step = _figure_stride(len(pc_x))
+    pc_x, pc_y, pc_z = pc_x[::step], pc_y[::step], pc_z[::step]
+
+    leaves_store = build_leaves_store(leaves, visited_key)
+
+    fig_visits = build_visits_figure(pc_x, pc_y, pc_z, leaves, visited_key)
+    if session_dir:
+        fig_seg = build_segmentation_figure(session_dir, leaves, pc_x, pc_y, pc_z)
+    else:
+        fig_seg = fig_visits
+    return {'segmentation': fig_seg, 'visits': fig_visits}, leaves_store
+
+
+# Bascule de vue sans aller-retour serveur : la figure est déjà dans figs-store
+app.clientside_callback(
+    """
+    function(mode, figs) {
+        if (!figs) {
+            return dash_clientside.no_update;
+        }
+        return figs[mode] || figs.visits;
+    }
+    """,
+    Output('pointcloud-3d', 'figure'),
+    Input('view-mode', 'value'),
+    Input('figs-store', 'data')
 )
-def update_leaf_info(click_data, session_signal):
-    # Chercher si une feuille a été cliquée
-    clicked_leaf_id = find_clicked_leaf(click_data, app_data['visited_leaves'], app_data['leaves_data'])
-    
-    if clicked_leaf_id and clicked_leaf_id != app_data['current_leaf_id']:
-        app_data['current_leaf_id'] = clicked_leaf_id
-        print(f"Feuille sélectionnée: {clicked_leaf_id}")
-    
-    # Si aucune feuille sélectionnée, afficher état par défaut
-    if app_data['current_leaf_id'] is None:
-        return [
-            html.Div("⌀ Aucune feuille sélectionnée", 
-                    style={'textAlign': 'center', 'color': '#666', 'fontSize': '12px', 
-                           'padding': '20px', 'fontStyle': 'italic'})
-        ]
+
+
+# Sélection de feuille côté navigateur : centroïde visité le plus proche du
+# clic, à moins de 2 cm (distance au carré < 4e-4), sans aller-retour serveur.
+# Les centroïdes et les points segmentés portent l'id de leur feuille
+# (customdata) : accès direct par store.index, parcours seulement pour le fond.
+app.clientside_callback(
+    """
+    function(clickData, store) {
+        if (!clickData || !clickData.points || !clickData.points.length || !store) {
+            return dash_clientside.no_update;
+        }
+        var p = clickData.points[0], xyz = store.centroids;
+        var i = store.index[p.customdata];
+        if (i !== undefined &&
+            (p.x - xyz[3*i]) ** 2 + (p.y - xyz[3*i+1]) ** 2 + (p.z - xyz[3*i+2]) ** 2 < 4e-4) {
+            return store.ids[i];
+        }
+        var best = null, bd = Infinity;
+        for (i = 0; i < store.ids.length; i++) {
+            var d = (p.x - xyz[3*i]) ** 2 + (p.y - xyz[3*i+1]) ** 2 + (p.z - xyz[3*i+2]) ** 2;
+            if (d < bd) { bd = d; best = store.ids[i]; }
+        }
+        return bd < 4e-4 ? best : dash_clientside.no_update;
+    }
+    """,
+    Output('selected-leaf', 'data'),
+    Input('pointcloud-3d', 'clickData'),
+    State('leaves-store', 'data')
+)
+
+
+def _current_leaf_id(selected_leaf, stale=False):
+    """
+    Feuille courante ; mise à jour seulement si le callback vient d'un clic.
+    Un clic qui ne change pas de feuille (re-clic) lève PreventUpdate : les
+    panneaux affichés sont déjà les bons — sauf si images/ ou analysis/ ont
+    changé depuis leur rendu (stale), une nouvelle mesure pouvant concerner
+    la feuille. Le signal de session, lui, redessine toujours.
+    """
+    if callback_context.triggered_id == 'selected-leaf':
+        if selected_leaf is None:
+            raise PreventUpdate
+        if selected_leaf == app_data['current_leaf_id']:
+            if not stale:
+                raise PreventUpdate
+            return selected_leaf
+        print(f"Feuille sélectionnée: {selected_leaf}")
+        app_data['current_leaf_id'] = selected_leaf
+    return app_data['current_leaf_id']
+
+
+def _render_info(leaf_id, leaves_data):
+    """Panneau infos d'une feuille (état par défaut si leaf_id est None)"""
+    if leaf_id is None:
+        return _EMPTY_LEAF_INFO
     
-    # Sinon, afficher les infos de la feuille
-    leaf_info = get_leaf_info_by_id(app_data['current_leaf_id'], app_data['leaves_data'])
+    leaf_info = get_leaf_info_by_id(leaf_id, leaves_data)
     
     return [
         html.P(f"ID: {leaf_info['leaf_id']}", style={'margin': '5px 0', 'fontSize': '12px'}),
@@ -986,38 +1306,16 @@ def update_leaf_info(click_data, session_signal):
         html.P(f"Date: {leaf_info['analysis_date']}", style={'margin': '5px 0', 'fontSize': '12px'})
     ]
 
-# Callback pour mise à jour de l'image
-@app.callback(
-    Output('leaf-image-content', 'children'),
-    [Input('pointcloud-3d', 'clickData'),
-     Input('session-changed-signal', 'children')],
-    prevent_initial_call=True
-)
-def update_leaf_image(click_data, session_signal):
-    # Chercher si une feuille a été cliquée
-    clicked_leaf_id = find_clicked_leaf(click_data, app_data['visited_leaves'], app_data['leaves_data'])
-    
-    if clicked_leaf_id:
-        app_data['current_leaf_id'] = clicked_leaf_id
-    
-    # Si aucune feuille sélectionnée, afficher état par défaut
-    if app_data['current_leaf_id'] is None:
-        return html.Div(
-            "⌀ Aucune image chargée",
-            style={
-                'height': '160px', 'backgroundColor': '#f5f5f5', 'display': 'flex',
-                'alignItems': 'center', 'justifyContent': 'center',
-                'borderRadius': '5px', 'fontSize': '12px', 'color': '#666',
-                'border': '2px dashed #ccc', 'fontStyle': 'italic'
-            }
-        )
+def _render_image(leaf_id, session_dir):
+    """Panneau image d'une feuille (état par défaut si leaf_id est None)"""
+    if leaf_id is None:
+        return _EMPTY_IMAGE
     
-    # Sinon, charger l'image de la feuille
-    leaf_image_src = get_leaf_image_by_id(app_data['current_leaf_id'], app_data['session_dir'])
+    img_path = get_leaf_image_by_id(leaf_id, session_dir)
     
-    if leaf_image_src:
+    if img_path:
         return html.Img(
-            src=leaf_image_src,
+            src=leaf_image_url(leaf_id, session_dir, img_path),
             style={
                 'width': '100%',
                 'height': 'auto',
@@ -1030,7 +1328,7 @@ def update_leaf_image(click_data, session_signal):
         )
     else:
         return html.Div(
-            f"Image feuille {app_data['current_leaf_id']} non trouvée",
+            f"Image feuille {leaf_id} non trouvée",
             style={
                 'height': '160px',
                 'backgroundColor': '#e9ecef',
@@ -1044,77 +1342,77 @@ def update_leaf_image(click_data, session_signal):
             }
         )
 
-
-# Callback pour mise à jour du graphique
-@app.callback(
-    Output('fluorescence-chart', 'figure'),
-    [Input('pointcloud-3d', 'clickData'),
-     Input('session-changed-signal', 'children')],
-    prevent_initial_call=True
-)
-def update_fluorescence_chart(click_data, session_signal):
-    # Chercher si une feuille a été cliquée
-    clicked_leaf_id = find_clicked_leaf(click_data, app_data['visited_leaves'], app_data['leaves_data'])
-    
-    if clicked_leaf_id:
-        app_data['current_leaf_id'] = clicked_leaf_id
-    
-    leaf_id = app_data['current_leaf_id']
-    
-    # Si aucune feuille sélectionnée, afficher état par défaut
+def _render_chart(leaf_id, session_dir, fluo_index):
+    """Graphique fluorescence d'une feuille (état par défaut si leaf_id est None)"""
     if leaf_id is None:
-        return go.Figure().update_layout(
-            title="⌀ Aucune données de fluorescence chargées",
-            xaxis_title="Temps (s)",
-            yaxis_title="Intensité", 
-            margin=dict(l=50, r=50, b=50, t=50),
-            showlegend=False,
-            annotations=[{
-                'text': 'Cliquez sur une feuille dans le point cloud<br>pour afficher ses données de fluorescence',
-                'xref': 'paper', 'yref': 'paper',
-                'x': 0.5, 'y': 0.5, 'xanchor': 'center', 'yanchor': 'middle',
-                'showarrow': False, 'font': {'size': 14, 'color': '#666'}
-            }]
-        )
+        return _EMPTY_CHART
     
-    # Sinon, charger données fluorescence pour cette feuille
-    if app_data['session_dir']:
-        time_data, fluor_data, fluor_config = load_fluorescence_data_for_leaf(app_data['session_dir'], leaf_id)
+    if session_dir:
+        time_data, fluor_data, fluor_config = load_fluorescence_data_for_leaf(fluo_index, leaf_id)
     else:
         time_data, fluor_data, fluor_config = [0, 1, 2, 3, 4], [0.016, 0.008, 0.014, 0.009, 0.014], {}
     
-    return go.Figure(data=[go.Scatter(
-        x=time_data, 
-        y=fluor_data,
-        mode='lines+markers',
-        name='Fluorescence',
-        line=dict(color='green', width=3)
-    )]).update_layout(
-        title=f"Mesure Fluorescence - Feuille {leaf_id}",
-        xaxis_title="Temps (s)",
-        yaxis_title="Intensité",
-        margin=dict(l=50, r=50, b=50, t=50),
-        plot_bgcolor='white',
-        height=280
-    )
+    return {
+        'data': [{
+            'type': 'scattergl',
+            'x': time_data,
+            'y': fluor_data,
+            'mode': 'lines+markers',
+            'name': 'Fluorescence',
+            'line': {'color': 'green', 'width': 3}
+        }],
+        'layout': _FLUOR_LAYOUT | {'title': {'text': f"Mesure Fluorescence - Feuille {leaf_id}"}}
+    }
+
+# Callback unique pour les panneaux feuille (infos, image, fluorescence) :
+# une seule requête et un seul rendu navigateur par sélection
+@app.callback(
+    [Output('leaf-info-content', 'children'),
+     Output('leaf-image-content', 'children'),
+     Output('fluorescence-chart', 'figure')],
+    [Input('selected-leaf', 'data'),
+     Input('session-changed-signal', 'children')],
+    prevent_initial_call=True
+)
+def update_leaf_panels(selected_leaf, session_signal):
+    # Images / mesures écrites depuis le dernier scan (contrôle par mtime) ;
+    # si les dossiers ont changé depuis le dernier rendu des panneaux, un
+    # re-clic redessine la feuille au lieu d'être ignoré
+    _refresh_session_scans()
+    stale = app_data['scan_mtimes'] != app_data['panels_scan_mtimes']
+    leaf_id = _current_leaf_id(selected_leaf, stale)
+    app_data['panels_scan_mtimes'] = app_data['scan_mtimes']
+    return (_render_info(leaf_id, app_data['leaves_data']),
+            _render_image(leaf_id, app_data['session_dir']),
+            _render_chart(leaf_id, app_data['session_dir'], app_data['fluo_index']))
+
+@functools.cache
+def _local_ip():
+    """
+    IP locale de la machine pour l'URL affichée. Résolution du hostname
+    d'abord ; l'astuce UDP vers 8.8.8.8 (aucun paquet envoyé) seulement si
+    elle ne donne que du loopback.
+    """
+    try:
+        for ip in socket.gethostbyname_ex(socket.gethostname())[2]:
+            if not ip.startswith("127."):
+                return ip
+    except OSError:
+        pass
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.settimeout(0.2)
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+    except OSError:
+        return "localhost"
 
 def main():
     """Lance l'application en mode navigateur"""
     print("Démarrage du Leaf Targeting Results Viewer...")
     print("=" * 50)
     
-    # Déterminer l'IP de la machine
-    import socket
-    try:
-        # Obtenir l'IP locale
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-    except:
-        local_ip = "localhost"
-    
-    print(f"URL: http://{local_ip}:8050")
+    print(f"URL: http://{_local_ip()}:8050")
     print("Arrêt: Ctrl+C")
     if targeting_data:
         print(f"Session: {targeting_data['session_dir'].name}")
@@ -1124,7 +1422,6 @@ def main():
     print("=" * 50)
     
     # Lancer l'application (accessible depuis le réseau)
-    import logging
     logging.getLogger('werkzeug').setLevel(logging.ERROR)  # Supprimer warning
     app.run(debug=False, port=8050, host='0.0.0.0')
 